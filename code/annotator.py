@@ -0,0 +1,165 @@
+'''
+The annotator's part in the conversion: get_response() asks them to decide between the features a construction may
+serve, and use_decisions() makes later runs replay their answers, or defer the questions to a pending file to be
+answered apart from the conversion (see resolve_pending() and apply_pending()).
+'''
+import os
+import json
+import multiprocessing
+
+import utils
+
+decisions = None # the DecisionCache in use, if any
+deferred_path = None # where questions are deferred to instead of prompting, if anywhere
+responses_asked = 0 # how many times get_response() was called, to know which results depend on the annotator
+
+
+class DecisionCache:
+    '''
+    The annotator's answers to get_response() prompts, kept in a json file so that reruns replay them instead of asking
+    again. Answers are stored by sentence id, head id and the kind of question asked about that head.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.decisions = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf8') as f:
+                self.decisions = json.load(f)
+
+    def get(self, key):
+        sent_id, head_id, kind = key
+        return self.decisions.get(sent_id, {}).get(str(head_id), {}).get(kind)
+
+    def set(self, key, response, save=True):
+        sent_id, head_id, kind = key
+        self.decisions.setdefault(sent_id, {}).setdefault(str(head_id), {})[kind] = response
+        if save:
+            self.save()
+
+    def invalidate(self, sent_ids=None, kinds=None):
+        '''
+        forgets the answers given in the sentences sent_ids to questions of the kinds kinds (None stands for all).
+        :return: the number of answers forgotten
+        '''
+        forgotten = 0
+        for sent_id in list(self.decisions):
+            if sent_ids is not None and sent_id not in sent_ids:
+                continue
+            for head_id in list(self.decisions[sent_id]):
+                for kind in list(self.decisions[sent_id][head_id]):
+                    if kinds is None or kind in kinds:
+                        del self.decisions[sent_id][head_id][kind]
+                        forgotten += 1
+                if not self.decisions[sent_id][head_id]:
+                    del self.decisions[sent_id][head_id]
+            if not self.decisions[sent_id]:
+                del self.decisions[sent_id]
+        if forgotten:
+            self.save()
+        return forgotten
+
+    def save(self):
+        utils.atomic_write(self.path, lambda f: json.dump(self.decisions, f, ensure_ascii=False, indent=1))
+
+
+_missing = object()
+
+
+def memoize_unless_asked(cache, key, compute):
+    '''
+    compute(), memoized in the utils.LRUCache cache under key. Results of computations that called get_response() are
+    not stored, as the annotator's answers hold for one sentence only.
+    '''
+    value = cache.get(key, _missing)
+    if value is _missing:
+        asked = responses_asked
+        value = compute()
+        if responses_asked == asked:
+            cache.put(key, value)
+    return value
+
+
+def use_decisions(path, defer_to=None):
+    '''
+    makes get_response() replay and record the annotator's answers in the json file in path.
+    If defer_to is given, get_response() never prompts: questions without a stored answer are appended to the pending
+    file in defer_to, and the first possible response is used provisionally.
+    '''
+    global decisions, deferred_path
+    decisions = DecisionCache(path)
+    deferred_path = defer_to
+    return decisions
+
+
+def get_response(possible_responses, prompt, key=None):
+    '''
+    When one construction may serve several features, let the annotator decide which it is.
+    :param key: (sent_id, head_id, kind) under which the answer is stored, if decisions are in use
+    '''
+    global responses_asked
+    responses_asked += 1
+    if key is not None and decisions is not None:
+        response = decisions.get(key)
+        if response in possible_responses:
+            return response
+
+    if deferred_path is not None:
+        sent_id, head_id, kind = key if key is not None else (None, None, None)
+        pending = {'sent_id': sent_id, 'head_id': head_id, 'kind': kind, 'options': list(possible_responses),
+                   'prompt': prompt, 'provisional': possible_responses[0], 'response': None}
+        # a single short append, so parallel workers can share the file
+        with open(deferred_path, 'a', encoding='utf8') as f:
+            f.write(json.dumps(pending, ensure_ascii=False) + '\n')
+        return possible_responses[0]
+
+    if multiprocessing.parent_process() is not None:
+        raise RuntimeError(f'the annotator can not be prompted from a worker process, convert with a single job. prompt: {prompt}')
+    response = None
+    while response not in possible_responses:
+        if response:
+            print(f'invalid response. options are {possible_responses}.')
+        print('##### USER INPUT NEEDED #####')
+        response = input(prompt)
+
+    if key is not None and decisions is not None:
+        decisions.set(key, response)
+    return response
+
+
+def read_pending(path):
+    with open(path, encoding='utf8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_pending(path, entries):
+    utils.atomic_write(path, lambda f: f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+
+
+def resolve_pending(path):
+    '''
+    lets the annotator answer the questions deferred to the pending file in path, saving after every answer.
+    Pending files can be split into several files (they have one question per line) for annotators to work in parallel.
+    '''
+    entries = read_pending(path)
+    for entry in entries:
+        if entry['response'] is None:
+            entry['response'] = get_response(entry['options'], entry['prompt'])
+            write_pending(path, entries)
+
+
+def apply_pending(paths):
+    '''
+    moves the answered questions of the pending files in paths to the decisions in use, leaving in the files only the
+    questions still waiting for an answer.
+    :return: the ids of the sentences that got new answers
+    '''
+    sent_ids = set()
+    for path in paths:
+        entries = read_pending(path)
+        for entry in entries:
+            if entry['response'] is not None:
+                decisions.set((entry['sent_id'], entry['head_id'], entry['kind']), entry['response'], save=False)
+                sent_ids.add(entry['sent_id'])
+        write_pending(path, [entry for entry in entries if entry['response'] is None])
+    decisions.save()
+    return sent_ids
@@ -0,0 +1,317 @@
+'''
+Measures the speed of the converters on the data bundled in data/, so that slowdowns are caught before a full run.
+
+The corpora:
+    italian     data/italian/{train,dev,test}.conllu, converted by italian/italian.py
+    serbian     the sentences of data/serbian/*.out.conllu without their ms-feats and abstract nodes, converted by
+                serbian/serbian.py
+
+The stages, timed on every corpus as it is (the best of --repeat runs):
+    parse       utils.parse_incr()
+    tree        building what the rules walk: build_tree() for Italian, utils.HeadIndex(...).post_order() for Serbian
+    apply       the rules: apply_rules() for Italian, apply_grammar() of every head for Serbian
+    serialize   TokenList.serialize() of the converted sentences
+    validate    validate.sentence_errors() of the converted sentences
+    convert     the whole conversion of the parsed sentences, serializing included
+For Serbian, tree and serialize are timed on their own, next to the conversion they are part of, and apply is timed
+inside it. The Italian rules log as the Italian driver does, but to os.devnull.
+
+The scaling runs replicate every corpus (with unique sent_ids) to --sizes sentences and stream them through parsing,
+conversion and validation, each in a fresh process, for its sentences per second and peak RSS.
+
+usage (launch from the repository root):
+python code/benchmark.py [--corpora italian serbian] [--sizes 10000 100000 1000000] [-o bench.json] [--compare old.json]
+'''
+import io
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import resource
+import importlib
+import contextlib
+import subprocess
+import importlib.metadata
+
+import conllu
+import utils
+import validate
+from registry import INVENTORY_PATH
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPORA = ['italian', 'serbian']
+
+
+def italian_texts():
+    texts = []
+    for split in ['train', 'dev', 'test']:
+        with open(os.path.join(ROOT, 'data', 'italian', f'{split}.conllu'), encoding='utf8') as f:
+            texts += list(conllu.parse_sentences(f))
+    return texts
+
+
+def serbian_texts():
+    '''
+    the Serbian sentences as they were before the conversion: without abstract nodes and without the ms-feats column.
+    '''
+    texts = []
+    for split in ['dev', 'test']:
+        with open(os.path.join(ROOT, 'data', 'serbian', f'{split}.out.conllu'), encoding='utf8') as f:
+            for text in conllu.parse_sentences(f):
+                lines = [line if line.startswith('#') else '\t'.join(line.split('\t')[:10])
+                         for line in text.split('\n') if line.startswith('#') or '.' not in line.split('\t')[0]]
+                texts.append('\n'.join(lines))
+    return texts
+
+
+def import_italian():
+    # the Italian modules import each other as code.italian.*, i.e. from the repository root
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module('code.italian.italian')
+
+
+def import_serbian():
+    # serbian.py reads its tables from its own directory
+    cwd = os.getcwd()
+    os.chdir(os.path.join(ROOT, 'code', 'serbian'))
+    try:
+        return importlib.import_module('serbian.serbian')
+    finally:
+        os.chdir(cwd)
+
+
+def load_corpus(name):
+    '''
+    :return: the raw text of every sentence of the corpus name, and a function converting a parsed sentence to text
+    '''
+    if name == 'italian':
+        return italian_texts(), import_italian().convert_sentence
+    serbian = import_serbian()
+    return serbian_texts(), serbian.convert_sentence
+
+
+def parse(texts):
+    return list(utils.parse_incr(io.StringIO('\n\n'.join(texts) + '\n\n')))
+
+
+class Timer:
+    '''
+    the total time spent in the with blocks of the timer, or in the calls of the functions it wraps.
+    '''
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        return timed
+
+
+def time_italian_stages(texts):
+    italian = import_italian()
+    timers = {stage: Timer() for stage in ['parse', 'tree', 'apply', 'serialize', 'validate']}
+    with timers['parse']:
+        sentences = parse(texts)
+    outputs = []
+    failed = 0
+    for tokenlist in sentences:
+        try:
+            with timers['tree']:
+                tree = italian.build_tree(tokenlist)
+            with timers['apply']:
+                italian.apply_rules(tree, utils.fixed_expressions(tokenlist))
+                italian.finish(tokenlist)
+        except Exception: # the rules do not handle every sentence yet
+            failed += 1
+            continue
+        with timers['serialize']:
+            outputs.append(tokenlist.serialize())
+    with timers['validate']:
+        for output in outputs:
+            validate.sentence_errors((1, output))
+    seconds = {stage: timer.seconds for stage, timer in timers.items()}
+    seconds['convert'] = seconds['tree'] + seconds['apply'] + seconds['serialize']
+    return seconds, failed
+
+
+def time_serbian_stages(texts):
+    serbian = import_serbian()
+    timers = {stage: Timer() for stage in ['parse', 'tree', 'apply', 'serialize', 'validate', 'convert']}
+    with timers['parse']:
+        sentences = parse(texts)
+    with timers['tree']:
+        for parse_list in sentences:
+            list(utils.HeadIndex(parse_list).post_order())
+
+    apply_grammar = serbian.apply_grammar
+    serbian.apply_grammar = timers['apply'].wrap(apply_grammar)
+    try:
+        outputs, converted = [], []
+        failed = 0
+        for parse_list in sentences:
+            try:
+                with timers['convert']:
+                    outputs.append(serbian.convert_sentence(parse_list))
+                converted.append(parse_list)
+            except Exception: # the rules do not handle every sentence yet
+                failed += 1
+    finally:
+        serbian.apply_grammar = apply_grammar
+
+    with timers['serialize']:
+        for parse_list in converted:
+            parse_list.serialize()
+    with timers['validate']:
+        for output in outputs:
+            validate.sentence_errors((1, output))
+    return {stage: timer.seconds for stage, timer in timers.items()}, failed
+
+
+def time_stages(name, repeat):
+    '''
+    the time of every stage on the corpus name, the best of repeat runs.
+    '''
+    texts = italian_texts() if name == 'italian' else serbian_texts()
+    time_corpus = time_italian_stages if name == 'italian' else time_serbian_stages
+    best = None
+    for _ in range(repeat):
+        seconds, failed = time_corpus(texts)
+        best = seconds if best is None else {stage: min(best[stage], seconds[stage]) for stage in best}
+    return {'sentences': len(texts), 'failed': failed,
+            'stages': {stage: {'seconds': round(seconds, 6), 'sentences_per_second': round(len(texts) / seconds, 1)}
+                       for stage, seconds in best.items()}}
+
+
+def replicated_texts(texts, size):
+    '''
+    yields size sentences, going through texts again and again, with a suffix making every sent_id unique.
+    '''
+    for i in range(size):
+        copy, index = divmod(i, len(texts))
+        text = texts[index]
+        if copy:
+            text = '\n'.join(f'{line}-{copy}' if line.startswith('# sent_id') else line for line in text.split('\n'))
+        yield text
+
+
+def peak_rss_mb():
+    # VmHWM is the peak of this process alone, while on Linux ru_maxrss also keeps the peak of the process it was
+    # started from
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # in KB
+
+
+def scaling_run(name, size):
+    '''
+    streams size sentences of the corpus name through parsing, conversion and validation, in this process.
+    '''
+    texts, convert = load_corpus(name)
+    failed = 0
+    start = time.perf_counter()
+    for text in replicated_texts(texts, size):
+        try:
+            output = convert(utils.parse_sentence(text))
+        except Exception:
+            failed += 1
+            continue
+        validate.sentence_errors((1, output))
+    seconds = time.perf_counter() - start
+    return {'corpus': name, 'sentences': size, 'failed': failed, 'seconds': round(seconds, 3),
+            'sentences_per_second': round(size / seconds, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def regressions(old, new, tolerance):
+    '''
+    the stages and scaling runs of new that are slower (or, for scaling runs, bigger) than in old by more than the
+    tolerance, as messages.
+    '''
+    found = []
+    for name, corpus in new['corpora'].items():
+        for stage, result in corpus['stages'].items():
+            before = old.get('corpora', {}).get(name, {}).get('stages', {}).get(stage)
+            if before and result['sentences_per_second'] < before['sentences_per_second'] * (1 - tolerance):
+                found.append(f'{name} {stage}: {before["sentences_per_second"]} -> {result["sentences_per_second"]} sentences/s')
+    old_runs = {(run['corpus'], run['sentences']): run for run in old.get('scaling', [])}
+    for run in new['scaling']:
+        before = old_runs.get((run['corpus'], run['sentences']))
+        if not before:
+            continue
+        if run['sentences_per_second'] < before['sentences_per_second'] * (1 - tolerance):
+            found.append(f'{run["corpus"]} x{run["sentences"]}: {before["sentences_per_second"]} -> '
+                         f'{run["sentences_per_second"]} sentences/s')
+        if run['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            found.append(f'{run["corpus"]} x{run["sentences"]}: peak RSS {before["peak_rss_mb"]} -> {run["peak_rss_mb"]} MB')
+    return found
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpora', nargs='+', default=CORPORA, choices=CORPORA)
+    parser.add_argument('--sizes', nargs='*', type=int, default=[10_000, 100_000, 1_000_000],
+                        help='number of sentences of the scaling runs (none to skip them)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every stage, the best one is reported')
+    parser.add_argument('-o', '--output', help='where to write the results as json (default: stdout)')
+    parser.add_argument('--compare', metavar='JSON', help='results of an earlier run: exit with 1 if something got slower')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='how much slower (or bigger) than in --compare is still not a regression (default: 0.2)')
+    parser.add_argument('--scaling-run', nargs=2, metavar=('CORPUS', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(module)s:%(lineno)d] %(levelname)s:%(message)s', filename=os.devnull,
+                        level=logging.DEBUG)
+    validate.use_inventory(INVENTORY_PATH)
+
+    if args.scaling_run: # a single scaling run, in its own process so its peak RSS is its own
+        name, size = args.scaling_run
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = scaling_run(name, int(size))
+        print(json.dumps(result))
+        sys.exit(0)
+
+    results = {'python': platform.python_version(), 'conllu': importlib.metadata.version('conllu'),
+               'machine': platform.machine(), 'cpus': os.cpu_count(), 'corpora': {}, 'scaling': []}
+    for name in args.corpora:
+        with contextlib.redirect_stdout(io.StringIO()): # what the converters print
+            results['corpora'][name] = time_stages(name, args.repeat)
+        print(f'{name}: {results["corpora"][name]["stages"]["convert"]["sentences_per_second"]} sentences/s converted',
+              file=sys.stderr)
+    for name in args.corpora:
+        for size in args.sizes:
+            run = subprocess.run([sys.executable, os.path.abspath(__file__), '--scaling-run', name, str(size)],
+                                 capture_output=True, text=True, check=True)
+            results['scaling'].append(json.loads(run.stdout.strip().split('\n')[-1]))
+            print(f'{name} x{size}: {results["scaling"][-1]["sentences_per_second"]} sentences/s, '
+                  f'{results["scaling"][-1]["peak_rss_mb"]} MB', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            found = regressions(json.load(f), results, args.tolerance)
+        for message in found:
+            print(f'regression: {message}', file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,694 @@
+'''
+The conversion engine shared by all the languages converted with the UD-to-MSP rules first written for English.
+Everything language specific lives in a language pack: a module, loaded lazily by language code, that provides
+
+    bank                the default treebank of the language (see consts.py), or None
+    excluded_genres     genres (from GENTLE-style sent_ids) not to convert
+    VERBAL, NOMINAL     the upos tags of verbal and nominal content heads
+    clausal_rels        the deprels of clauses
+    case_feat_map       a map from adpositions and conjunctions (or fixed expressions) to relation features
+    relation_particles  lemmas of PART nodes that mark relations rather than TAM (e.g., "'s")
+    degree_markers      a map from the lemmas of degree words to the Degree they set (e.g., 'more': 'Cmp')
+    modalities          a map from modal auxiliaries to their Mood
+    determiners         a map from determiners to tuples of feature names and values
+    get_nTAM_feats      the auxiliary handler: (aux_nodes, head_feats, verb, head, children, sentence) -> feats
+    nTAM_signature      optional, the inputs get_nTAM_feats depends on: (aux_nodes, head_feats, verb, children) -> a
+                        hashable signature. Packs that have it get their auxiliary handler memoized
+
+usage (launch from a directory with the UD treebanks, see consts.py):
+python code/engine.py --lang eng [--split test]
+python code/engine.py --lang eng --rule-stats rules.json    # how often every rule fires and what it costs
+'''
+import os
+import sys
+import json
+import importlib
+import inspect
+from functools import partial
+from typing import List
+from copy import deepcopy
+
+import conllu
+import utils
+import annotator
+import incremental
+
+# language code -> module of its pack
+PACKS = {
+    'eng': 'english.english',
+    'deu': 'german.german',
+    'heb': 'hebrew.hebrew',
+    'por': 'portuguese.portuguese',
+    'swe': 'swedish.swedish',
+    'ukr': 'ukrainian.ukrainian',
+}
+
+
+def load_pack(lang):
+    '''
+    imports the pack of lang on first use; only packs actually used are ever imported.
+    '''
+    if lang not in PACKS:
+        raise ValueError(f'no language pack for "{lang}". available: {sorted(PACKS)}')
+    return importlib.import_module(PACKS[lang])
+
+
+def create_abstract_nsubj(head: conllu.Token, auxes: List[conllu.Token]):
+    '''
+    When the subject is missing but agreement features appear on its head, an abstract node carrying features only is created
+    '''
+    abstract_nsubj = conllu.Token()
+    abstract_nsubj['id'] = head['id'] - 0.9 # to make sure it's between the head and the first child
+    abstract_nsubj['form'] = '-' # set all values to '-', but set the head and the deprel
+    abstract_nsubj['lemma'] = '-'
+    abstract_nsubj['upos'] = '-'
+    abstract_nsubj['xpos'] = '-'
+    abstract_nsubj['deps'] = '-'
+    abstract_nsubj['misc'] = '-'
+    abstract_nsubj['head'] = head['id']
+    abstract_nsubj['deprel'] = 'nsubj'
+    abstract_nsubj['ms feats'] = {}
+
+    if auxes: # if there are auxiliaries, take the features from the first one
+        first_aux_id = min([child['id'] for child in auxes])
+        feats_source = [aux for aux in auxes if aux['id'] == first_aux_id][0]
+    else: # if there are no auxiliaries, take the features from the head
+        feats_source = head
+
+    for attr in ['Number', 'Person', 'Gender']: # copy the features from the head or the auxiliaries
+        abstract_nsubj['ms feats'][attr] = feats_source['feats'].get(attr, head['feats'].get(attr, None)) # if the feature is not in the auxiliaries, take it from the head
+    abstract_nsubj['ms feats'] = {k:v for k,v in abstract_nsubj['ms feats'].items() if v} #clean up nones
+
+    # in case of some pragmatical omission of subject with no agreement on the predicate - do not create abstract node
+    if not abstract_nsubj['ms feats']:
+        return None
+
+    return abstract_nsubj
+
+
+def get_rel_feat(pack, word, fixed_lemma=None): # try to get the relation feature of the fixed expression from the case feature map, if not - of the word, if not - return the word itself
+    if fixed_lemma in pack.case_feat_map:
+        return pack.case_feat_map[fixed_lemma]
+    return pack.case_feat_map.get(word, word)
+
+
+def get_relation_feats(pack, relation_nodes: List[conllu.Token], verb=True, clause=False, fixed_lemmas=None) -> dict:
+    '''
+    Generating morpho_syntactic features for relations.
+    The mapping from words (or fixed expressions) to features is the case_feat_map of the language pack (e.g.,
+    'english/eng_relations.py') and should be updated there. Fixed expressions are looked up by their multiword lemma in
+    fixed_lemmas (see utils.fixed_expressions()).
+    '''
+    feats = {}
+    fixed_lemmas = fixed_lemmas or {}
+
+    feats['Case'] = ';'.join([get_rel_feat(pack, node['lemma'], fixed_lemmas.get(node['id'])) # the multiword lemma of the heads of fixed expressions
+                             for node in relation_nodes])
+
+    return feats
+
+
+def copy_feats(ms_feats, morpho_feats, values):
+    '''
+    copies features from morpho_feats to ms_feats only is they do not exist in morpho_feats.
+    '''
+    for value in values:
+        ms_feats[value] = ms_feats.get(value, morpho_feats.get(value, None))
+    return ms_feats
+
+
+def set_nodes(nodes):
+    '''
+    conllu.Token is not hashable so sets consist of ids
+    '''
+    return {node['id'] for node in nodes}
+
+
+nTAM_cache = utils.LRUCache(maxsize=1 << 14)
+
+
+def get_nTAM_feats(pack, aux_nodes, head_feats, verb, head, children, sentence) -> dict:
+    '''
+    the auxiliary handler of the pack, memoized by the pack's nTAM_signature(). Features that needed the annotator are
+    never memoized.
+    '''
+    compute = lambda: pack.get_nTAM_feats(aux_nodes, head_feats, verb=verb, head=head, children=children, sentence=sentence)
+    if not hasattr(pack, 'nTAM_signature'):
+        return compute()
+    key = (pack.__name__, pack.nTAM_signature(aux_nodes, head_feats, verb=verb, children=children))
+    return dict(annotator.memoize_unless_asked(nTAM_cache, key, compute))
+
+
+def partition_children(pack, children: List[conllu.Token]) -> dict:
+    '''
+    groups the children of a head by their role, in a single pass and in the order of the sentence:
+    'fixed' - fixed nodes, whose lemmas make one lemma with the head's (see utils.fixed_expressions())
+    'TAM' - auxiliaries and particles, consumed by the auxiliary handler of the pack
+    'relation' - adpositions, conjunctions and other markers of relations, consumed by get_relation_feats
+    'rest' - all other children, which keep their own features
+    Punctuation, parataxis and reparandum are in no group. A child that looks both like a TAM node and like a relation
+    node is in both groups.
+    '''
+    groups = {'fixed': [], 'TAM': [], 'relation': [], 'rest': []}
+    for child in children:
+        deprel, upos, lemma = child['deprel'], child['upos'], child['lemma']
+        if deprel in {'parataxis', 'reparandum', 'punct'}:
+            continue
+        if deprel == 'fixed':
+            groups['fixed'].append(child)
+            continue
+
+        # consider all aux and part nodes, except for particles marking relations (e.g. "'s")
+        TAM = upos in {'AUX', 'PART'} and lemma not in pack.relation_particles
+        # the last condition is complicated to exclude infinitive "to" while allowing case "'s"
+        relation = ((deprel in {'case', 'mark', 'cc'} or lemma in pack.case_feat_map)
+                    and (upos != 'PART' or lemma in pack.relation_particles))
+        if TAM:
+            groups['TAM'].append(child)
+        if relation:
+            groups['relation'].append(child)
+        if not (TAM or relation):
+            groups['rest'].append(child)
+    return groups
+
+
+def apply_grammar(pack, head: conllu.Token, children: List[conllu.Token], sentence: conllu.TokenList = None,
+                  fixed_lemmas: dict = None):
+    '''
+    The main method combining functional children to create the morpho-syntactic features of head, using the tables
+    and the auxiliary handler of the language pack.
+    In cases where several function words are combined to one meaning (e.g., because of, more than) they are tagged with
+    a 'fixed' deprel, and the relation they mark is looked up by their multiword lemma in fixed_lemmas.
+    '''
+    all_children = children
+    groups = partition_children(pack, children)
+
+    if groups['fixed']:
+        utils.rule_hit('fixed expression')
+
+    added_nodes = []
+
+    verb = head['upos'] in pack.VERBAL
+    noun = head['upos'] in pack.NOMINAL
+
+    if verb: # only if the head is not a verb, copy the existing features to ms_feats
+        head['ms feats'] = {}
+    else:
+        head['ms feats'] = deepcopy(head['feats'])
+
+    # if there are auxiliaries "consume" them to change head's feats
+    TAM_nodes = groups['TAM']
+    if TAM_nodes:
+        head['ms feats'].update(get_nTAM_feats(pack, TAM_nodes, head['feats'], verb, head, all_children, sentence)) # update the head's features with the features of the auxiliaries
+
+        if not head['ms feats'].get('Mood', None): head['ms feats']['Mood'] = 'Ind' #set Mood to Ind by default
+        if not head['ms feats'].get('Polarity', None): head['ms feats']['Polarity'] = 'Pos' #set Polarity to Pos by default
+        if not head['ms feats'].get('VerbForm', None): head['ms feats']['VerbForm'] = 'Fin' #set VerbForm to Fin by default
+
+    # if there are cases or conjunctures "consume" them as well
+    relation_nodes = groups['relation']
+    if relation_nodes:
+        to_update = get_relation_feats(pack, relation_nodes, verb=verb, clause=head['deprel'] in pack.clausal_rels,
+                                       fixed_lemmas=fixed_lemmas)
+        if to_update and not head['ms feats']:
+            head['ms feats'] = to_update
+        else:
+            head['ms feats'].update(to_update)
+
+    # make sure we did not use the same node twice
+    assert not set_nodes(TAM_nodes) & set_nodes(relation_nodes)
+    children = groups['rest'] # the children without the auxiliaries and the relations
+
+    if verb:
+        # copy values from the morphological feats if they were not set by now
+        head['ms feats'] = copy_feats(head['ms feats'], head['feats'], ['Mood','Tense','Aspect','Voice','VerbForm','Polarity'])
+
+        # set default values for feats underspecified in UD
+        if not head['ms feats'].get('Voice', None):
+            utils.rule_hit('default Voice')
+            head['ms feats']['Voice'] = 'Act'
+
+        # not sure it's needed for languages that are not pro-drop (e.g. eng), there always should be an nsubj.
+        if head['ms feats']['VerbForm'] == 'Fin' and 'nsubj' not in [child['deprel'] for child in children]:
+            abstract_nsubj = create_abstract_nsubj(head, TAM_nodes) # create an abstract subject node if there is no subject
+            if abstract_nsubj:
+                utils.rule_hit('abstract nsubj')
+                added_nodes.append(abstract_nsubj)
+
+    elif noun or head['upos'] in {'ADV', 'ADJ'}:
+        # treat determiners
+        det_nodes = [child for child in children if child['deprel'] == 'det']
+        if det_nodes:
+            utils.rule_hit('determiner')
+            assert len(det_nodes) == 1 # there should only be one determiner
+            det_node = det_nodes[0]
+            children = [node for node in children if node['id'] != det_node['id']]
+            for lemma in pack.determiners[det_node['lemma']]: # set the appropriate features to the head using the det_feats map
+                if lemma in head['ms feats']:
+                    det_feats = head['ms feats'][lemma]
+                    head['ms feats'][det_feats[0]] = det_feats[1]
+                    if len(det_feats) == 4:
+                        head['ms feats'][det_feats[2]] = det_feats[3]
+                else:
+                    utils.rule_hit('untreated determiner')
+                    report(f'a non treated determiner: "{det_node["lemma"]}"') # overlooked determiners
+                    children = [det_node] + children
+
+        if head['upos'] in {'ADV', 'ADJ'} and children:
+            child_lemmas = [child['lemma'] for child in children]
+            for lemma, degree in pack.degree_markers.items(): # e.g. a 'more' node sets the degree to comparative
+                if lemma in child_lemmas:
+                    utils.rule_hit('degree')
+                    head['ms feats']['Degree'] = degree
+                    break
+            children = [node for node in children if node['lemma'] not in pack.degree_markers] # remove the degree markers (e.g. 'more' and 'most') from the children
+
+    if head['ms feats']: # clean up the ms_feats by removing None values
+        head['ms feats'] = {k: v for k, v in head['ms feats'].items() if v}
+
+    for child in children:
+        if child['upos'] in {'ADV', 'ADJ', 'INTJ', 'DET'} | pack.VERBAL | pack.NOMINAL and not child.get('ms feats', None): # if the child is a content node and the ms_feats are not set
+            ms_feats = deepcopy(child['feats']) # copy the features from the child's feats
+            if ms_feats is None: # if the child has no feats, set the feats to an separator
+                ms_feats = '|'
+            child['ms feats'] = ms_feats
+
+    return added_nodes
+
+
+grammar_cache = None # optional LRUCache of apply_grammar outcomes by local configuration, see use_grammar_cache()
+reported = None # the messages report() printed while an outcome of apply_grammar is recorded
+
+
+def use_grammar_cache(maxsize):
+    '''
+    makes convert_sentence reuse the outcome of apply_grammar for configurations of a head and its children that were
+    seen before, keeping the maxsize most recently used ones. 0 turns the cache off.
+    '''
+    global grammar_cache
+    grammar_cache = utils.LRUCache(maxsize) if maxsize else None
+
+
+def report(message):
+    print(message)
+    if reported is not None:
+        reported.append(message)
+
+
+def local_configuration(pack, head, children, fixed_lemmas=None):
+    '''
+    everything apply_grammar reads from a head and its children, apart from what it only shows the annotator.
+    Positions are kept relative to the head, so the same configuration in another place gives the same signature.
+    Lemmas and forms are only kept where rules look at them, which is what makes configurations of content words repeat.
+    '''
+    fixed_lemmas = fixed_lemmas or {}
+    return (pack.__name__,
+            (head['upos'], head['deprel'] in pack.clausal_rels, utils.feats_key(head['feats'])),
+            tuple(child_configuration(pack, head, child, fixed_lemmas.get(child['id'])) for child in children))
+
+
+def child_configuration(pack, head, child, fixed_lemma=None):
+    deprel, upos, lemma = child['deprel'], child['upos'], child['lemma']
+    function = upos in {'AUX', 'PART'} # the lemmas, forms and feats of auxiliaries are all read to get the TAM features
+    has_ms_feats = bool(child.get('ms feats', None))
+    if not (function or deprel in {'fixed', 'det', 'case', 'mark', 'cc'}
+            or lemma in pack.case_feat_map or lemma in pack.degree_markers):
+        lemma = None
+    form = child['form'] if function else child['form'] == '?' # a question mark marks questions
+    # the feats of content children only end up copied to their ms feats, which is replayed as copying (see OWN_FEATS)
+    feats = utils.feats_key(child['feats']) if function else None
+    return child['id'] < head['id'], deprel, upos, lemma, fixed_lemma, form, feats, has_ms_feats
+
+
+OWN_FEATS = object() # in a stored outcome, stands for ms feats copied from the node's own feats
+
+
+def copy_value(value):
+    return dict(value) if isinstance(value, dict) else value
+
+
+def own_ms_feats(node):
+    return '|' if node['feats'] is None else dict(node['feats'])
+
+
+def apply_grammar_cached(pack, head: conllu.Token, children: List[conllu.Token], sentence: conllu.TokenList = None,
+                         fixed_lemmas: dict = None):
+    '''
+    apply_grammar, reusing its outcome from grammar_cache if the local configuration of head and children was seen
+    before: the ms feats of the head and of the children, the abstract nodes added (relative to the head) and the
+    messages reported. Outcomes that needed the annotator are not stored.
+    '''
+    global reported
+    if grammar_cache is None:
+        return apply_grammar(pack, head, children, sentence, fixed_lemmas)
+
+    key = local_configuration(pack, head, children, fixed_lemmas)
+    outcome = grammar_cache.get(key)
+    if outcome is not None:
+        head_ms_feats, child_ms_feats, added, messages = outcome
+        head['ms feats'] = copy_value(head_ms_feats)
+        for i, ms_feats in child_ms_feats:
+            children[i]['ms feats'] = own_ms_feats(children[i]) if ms_feats is OWN_FEATS else copy_value(ms_feats)
+        added_nodes = []
+        for offset, node in added:
+            node = conllu.Token({field: copy_value(value) for field, value in node.items()})
+            node['id'] = head['id'] + offset
+            node['head'] = head['id']
+            added_nodes.append(node)
+        for message in messages:
+            print(message)
+        return added_nodes
+
+    before = [child.get('ms feats', None) for child in children]
+    asked = annotator.responses_asked
+    reported = []
+    try:
+        added_nodes = apply_grammar(pack, head, children, sentence, fixed_lemmas)
+        messages = reported
+    finally:
+        reported = None
+    if annotator.responses_asked == asked:
+        child_ms_feats = []
+        for i, child in enumerate(children):
+            ms_feats = child.get('ms feats', None)
+            if ms_feats is before[i]:
+                continue
+            if ms_feats == own_ms_feats(child):
+                child_ms_feats.append((i, OWN_FEATS))
+            elif child['upos'] in {'AUX', 'PART'}: # the only children whose feats are in the configuration
+                child_ms_feats.append((i, copy_value(ms_feats)))
+            else: # would depend on feats the configuration does not hold, so it can not be reused
+                return added_nodes
+        # rounded, so that adding the offset to another head gives the very same id as creating the node there
+        added = [(round(node['id'] - head['id'], 6), {field: copy_value(value) for field, value in node.items()})
+                 for node in added_nodes]
+        grammar_cache.put(key, (copy_value(head['ms feats']), child_ms_feats, added, messages))
+    return added_nodes
+
+
+# the functions timed as rules of their own when rules are counted, see use_rule_stats()
+TIMED_FUNCTIONS = ['convert_sentence', 'apply_grammar_cached', 'apply_grammar', 'partition_children', 'get_nTAM_feats',
+                   'get_relation_feats', 'create_abstract_nsubj']
+
+
+def use_rule_stats():
+    '''
+    starts counting the rules of the conversion: the functions in TIMED_FUNCTIONS and the branches marked with
+    utils.rule_hit() here and in the language packs. The functions are only wrapped now, so nothing is spent on
+    counting when this is never called. Calls answered by nTAM_cache or grammar_cache are counted for the function
+    called but not for the branches that are skipped.
+    '''
+    stats = utils.use_rule_stats()
+    module = sys.modules[__name__]
+    for name in TIMED_FUNCTIONS:
+        setattr(module, name, stats.wrap(getattr(module, name), name))
+    return stats
+
+
+def rule_stats_report(lang, pack, stats):
+    '''
+    the hits and seconds of every rule of a run with the pack of lang, with the rules that never fired.
+    '''
+    rules = {'lang': lang}
+    rules.update(stats.report(utils.declared_rules(sys.modules[__name__], pack.get_nTAM_feats) | set(TIMED_FUNCTIONS)))
+    rules['nTAM cache'] = nTAM_cache.stats()
+    if grammar_cache is not None:
+        rules['grammar cache'] = grammar_cache.stats()
+    return rules
+
+
+def get_where_to_add(added_nodes, head_index): # get where to add the abstract nsubj, right now before the verb, might change to after
+    res = []
+    for node in added_nodes:
+        idx = int(node['id'])
+        if idx == 0:
+            res.append(-1)
+        else:
+            res.append(head_index.position(idx))
+    return res
+
+def order_alphabetically(feats):
+    if not feats:
+        return feats
+    if isinstance(feats, dict):
+        feats = '|'.join(f'{k}={v}' for k, v in feats.items())
+    feats = feats.split('|')
+    feats = sorted(feats)
+    return '|'.join(feats)
+
+def in_excluded_genre(pack, parse_list: conllu.TokenList):
+    if not pack.excluded_genres:
+        return False
+    return parse_list.metadata['sent_id'].split('_')[1] in pack.excluded_genres
+
+
+def convert_sentence(pack, parse_list: conllu.TokenList) -> str:
+    '''
+    applies the grammar to all heads of one sentence and returns it serialized with its ms-feats.
+    '''
+    head_index = utils.HeadIndex(parse_list)
+    heads = list(head_index.post_order())
+    assert utils.verify_span(heads[::-1])
+    fixed_lemmas = utils.fixed_expressions(parse_list)
+    to_add = []
+    for head, children in heads:
+        children = [parse_list[i] for i in head_index.children(head)]
+        head: conllu.Token = parse_list[head_index.position(head)]
+        added_nodes = apply_grammar_cached(pack, head, children, parse_list, fixed_lemmas)
+        if added_nodes:
+            added_idxs = get_where_to_add(added_nodes, head_index)
+            to_add += list(zip(added_nodes, added_idxs))
+
+    # from the last position to the first, so that no insertion shifts the positions of those still to come
+    for node, idx in sorted(to_add, key=lambda added: (added[1], added[0]['id']), reverse=True):
+        parse_list.insert(idx + 1, node)
+
+    for node in parse_list:
+        # setting ms-feats for content nodes that were not dealt with earlier
+        if node['upos'] in {'ADJ', 'INTJ'} | pack.VERBAL | pack.NOMINAL and not node.get('ms feats', None): # if the node is a content node and the ms_feats are not set
+            ms_feats = deepcopy(node['feats'])
+            if ms_feats is None:
+                ms_feats = '|'
+            node['ms feats'] = ms_feats
+        # function nodes end up with empty ms-feats
+        else:
+            node['ms feats'] = node.get('ms feats', None)
+
+        # sort alphabetically the MS features of all nodes
+        node['ms feats'] = order_alphabetically(node['ms feats'])
+    utils.verify_treeness(parse_list)
+
+    return parse_list.serialize()
+
+
+def convert_batch(pack, parse_lists, outfile):
+    '''
+    parses (or loads from the parse cache) the whole treebank before converting it.
+    '''
+    sentences = [parse_list for parse_list in parse_lists if not in_excluded_genre(pack, parse_list)]
+
+    for parse_list in sentences: # iterate over the sentences
+        outfile.write(convert_sentence(pack, parse_list) + '\n')
+
+
+def convert_stream(pack, parse_lists, outfile):
+    '''
+    reads, converts and writes one sentence at a time, so memory does not grow with the size of the treebank.
+    The output is identical to that of convert_batch.
+    '''
+    for parse_list in parse_lists:
+        if in_excluded_genre(pack, parse_list):
+            continue
+        outfile.write(convert_sentence(pack, parse_list) + '\n')
+
+
+def convert_text(lang: str, text: str) -> str:
+    '''
+    converts the raw text of one sentence with the pack of lang; the unit of work of the parallel mode, where every
+    worker loads the pack on its first sentence.
+    '''
+    pack = load_pack(lang)
+    parse_list = utils.parse_sentence(text)
+    if in_excluded_genre(pack, parse_list):
+        return ''
+    return convert_sentence(pack, parse_list) + '\n'
+
+
+def convert_text_indexed(lang: str, text: str):
+    '''
+    convert_text(), along with the sent_id of the sentence and its words (see incremental.sentence_words()), so
+    --incremental can index the sentences in the parallel mode.
+    '''
+    pack = load_pack(lang)
+    parse_list = utils.parse_sentence(text)
+    sent_id, words = parse_list.metadata.get('sent_id'), incremental.sentence_words(parse_list)
+    if in_excluded_genre(pack, parse_list):
+        return '', sent_id, words
+    return convert_sentence(pack, parse_list) + '\n', sent_id, words
+
+
+def init_worker(decisions_path, defer_to, grammar_cache_size):
+    '''
+    sets up every worker of the parallel mode like the main process.
+    '''
+    annotator.use_decisions(decisions_path, defer_to)
+    use_grammar_cache(grammar_cache_size)
+
+
+def rule_tables(pack):
+    '''
+    the tables of the pack whose entries are looked up by the lemma, upos or deprel of a node, with the column they are
+    looked up by. A change to an entry only affects the sentences holding its key (see
+    incremental.affected_sentences()).
+    '''
+    return {'case_feat_map': ('lemma', pack.case_feat_map), 'relation_particles': ('lemma', pack.relation_particles),
+            'degree_markers': ('lemma', pack.degree_markers), 'modalities': ('lemma', pack.modalities),
+            'determiners': ('lemma', pack.determiners), 'VERBAL': ('upos', pack.VERBAL),
+            'NOMINAL': ('upos', pack.NOMINAL), 'clausal_rels': ('deprel', pack.clausal_rels)}
+
+
+def code_fingerprint(pack):
+    '''
+    a hash of everything else the conversion with pack depends on: the engine, utils, annotator, the functions of the
+    pack and its excluded genres. Any change to them means converting everything again.
+    '''
+    functions = [obj for obj in vars(pack).values() if inspect.isfunction(obj)]
+    return incremental.code_fingerprint(sys.modules[__name__], utils, annotator, *functions, pack.excluded_genres)
+
+
+def reconvert(lang, infile, sent_ids) -> dict:
+    '''
+    converts again with the pack of lang only the sentences of infile whose ids are in sent_ids.
+    :return: a dict from the sentence ids to their new text
+    '''
+    replacements = {}
+    for text in conllu.parse_sentences(infile):
+        sent_id = utils.sentence_id(text)
+        if sent_id in sent_ids:
+            replacements[sent_id] = convert_text(lang, text)
+    return replacements
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lang', default='eng', choices=sorted(PACKS), help='the language pack to convert with')
+    parser.add_argument('--bank', help='the treebank to convert (default: the default bank of the language)')
+    parser.add_argument('--split', default='test', choices=['train', 'dev', 'test'])
+    parser.add_argument('-i', '--input', help='the conllu file to convert (default: taken from consts.py)')
+    parser.add_argument('-o', '--output', help='where to write the converted file (default: UD+/LANG/BANK/SPLIT.conllu)')
+    parser.add_argument('--stream', action='store_true',
+                        help='convert one sentence at a time instead of loading the whole treebank first')
+    parser.add_argument('--parse-cache', metavar='DIR',
+                        help='keep the parsed input in DIR and load it from there as long as the input is unchanged')
+    parser.add_argument('--grammar-cache', type=int, default=0, metavar='SIZE',
+                        help='reuse the outcome of the grammar for configurations of a head and its children seen before, '
+                             'keeping at most SIZE of them (default: off)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes. annotator prompts are only possible with a single job, '
+                             'so run with one job first, replay stored decisions or defer the questions')
+    parser.add_argument('--decisions', help='json file of the annotator\'s decisions (default: next to the output)')
+    parser.add_argument('--forget', action='append', metavar='SENT_ID',
+                        help='ask again the questions of this sentence (may be repeated)')
+    parser.add_argument('--forget-kind', action='append', choices=['inversion', 'would', 'could'],
+                        help='ask again the questions of this kind (may be repeated)')
+    parser.add_argument('--defer', metavar='PENDING',
+                        help='never prompt: write unanswered questions to this pending file and use provisional answers')
+    parser.add_argument('--resolve', nargs='+', metavar='PENDING',
+                        help='only let the annotator answer the questions in these pending files')
+    parser.add_argument('--apply', nargs='+', metavar='PENDING',
+                        help='only reconvert the sentences whose pending questions were answered, in the existing output')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only reconvert the sentences affected by the rule tables changed since the last run, in the '
+                             'existing output. everything is converted if the input or the code changed')
+    parser.add_argument('--rule-stats', metavar='JSON',
+                        help='count how often every rule fires and how long it takes, and write the report to JSON')
+    args = parser.parse_args()
+    if args.incremental and (args.defer or args.forget or args.forget_kind):
+        parser.error('--incremental can not be combined with --defer, --forget or --forget-kind')
+    if args.rule_stats and args.jobs > 1:
+        parser.error('--rule-stats needs a single job, the workers do not count rules')
+
+    pack = load_pack(args.lang)
+    use_grammar_cache(args.grammar_cache)
+    rule_stats = use_rule_stats() if args.rule_stats else None
+    bank = args.bank or pack.bank
+    if bank is None and not (args.input and args.output):
+        parser.error(f'no default treebank for {args.lang}, give --bank or both --input and --output')
+    if args.input:
+        filepath = args.input
+    else:
+        from consts import ud_dir, splits
+        filepath = os.path.join(ud_dir, args.lang, bank, splits[bank][args.split])
+    out_path = args.output or os.path.join('UD+', args.lang, bank, f'{args.split}.conllu')
+    decisions_path = args.decisions or out_path + '.decisions.json'
+
+    if args.resolve:
+        for pending_path in args.resolve:
+            annotator.resolve_pending(pending_path)
+
+    elif args.apply:
+        # questions still unanswered are already in the pending files, so they are only answered provisionally again
+        annotator.use_decisions(decisions_path, defer_to=os.devnull)
+        sent_ids = annotator.apply_pending(args.apply)
+        with open(filepath, encoding='utf8') as infile:
+            replacements = reconvert(args.lang, infile, sent_ids)
+        incremental.splice_sentences(out_path, replacements)
+        print(f'reconverted {len(replacements)} sentences')
+
+    else:
+        decisions = annotator.use_decisions(decisions_path, defer_to=args.defer)
+        if args.forget or args.forget_kind:
+            forgotten = decisions.invalidate(args.forget, args.forget_kind)
+            print(f'forgot {forgotten} decisions')
+        if args.defer:
+            open(args.defer, 'w').close() # every run starts a new queue
+
+        dependencies_path = out_path + '.deps.json'
+        affected = None
+        if args.incremental:
+            input_key, code, tables = utils.parse_cache_key(filepath), code_fingerprint(pack), rule_tables(pack)
+            dependencies = incremental.load_dependencies(dependencies_path) if os.path.exists(out_path) else None
+            affected = incremental.affected_sentences(dependencies, input_key, code, tables)
+
+        if affected is not None:
+            with open(filepath, encoding='utf8') as infile:
+                replacements = reconvert(args.lang, infile, affected)
+            incremental.splice_sentences(out_path, replacements)
+            incremental.save_dependencies(dependencies_path, input_key, code, tables, dependencies['index'])
+            print(f'reconverted {len(replacements)} sentences')
+
+        else:
+            # the sentences are indexed as they are converted, so the input is read once
+            indexer = incremental.SentenceIndexer() if args.incremental else None
+            with open(filepath, encoding='utf8') as infile, open(out_path, 'w', encoding='utf8') as outfile:
+                if args.jobs > 1 and indexer is not None:
+                    for converted, sent_id, words in utils.map_in_parallel(
+                            partial(convert_text_indexed, args.lang), conllu.parse_sentences(infile), args.jobs,
+                            initializer=init_worker, initargs=(decisions_path, args.defer, args.grammar_cache)):
+                        outfile.write(converted)
+                        indexer.add(sent_id, words)
+                elif args.jobs > 1:
+                    utils.convert_in_parallel(infile, outfile, partial(convert_text, args.lang), args.jobs,
+                                              initializer=init_worker,
+                                              initargs=(decisions_path, args.defer, args.grammar_cache))
+                else:
+                    parse_lists = (utils.parse_cached(filepath, args.parse_cache) if args.parse_cache
+                                   else utils.parse_incr(infile))
+                    if indexer is not None:
+                        parse_lists = indexer.indexed(parse_lists)
+                    if args.stream:
+                        convert_stream(pack, parse_lists, outfile)
+                    else:
+                        convert_batch(pack, parse_lists, outfile)
+            if indexer is not None:
+                incremental.save_dependencies(dependencies_path, input_key, code, tables, indexer.index)
+
+        if grammar_cache is not None:
+            stats = grammar_cache.stats()
+            print(f'grammar cache: {stats["hits"]} hits, {stats["misses"]} misses, {stats["size"]}/{stats["maxsize"]} entries')
+
+    if rule_stats is not None:
+        with open(args.rule_stats, 'w', encoding='utf8') as f:
+            json.dump(rule_stats_report(args.lang, pack, rule_stats), f, indent=2)
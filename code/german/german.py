@@ -0,0 +1,9 @@
+'''
+The German language pack of the conversion engine (see engine.py).
+German has no rules of its own yet, so it uses the English tables and auxiliary handler. Override them here as the
+German rules are written.
+'''
+from english.english import *
+
+bank = None
+excluded_genres = []
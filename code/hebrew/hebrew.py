@@ -0,0 +1,9 @@
+'''
+The Hebrew language pack of the conversion engine (see engine.py).
+Hebrew has no rules of its own yet, so it uses the English tables and auxiliary handler. Override them here as the
+Hebrew rules are written.
+'''
+from english.english import *
+
+bank = 'HTB'
+excluded_genres = []
@@ -0,0 +1,157 @@
+'''
+What incremental conversion needs to know which sentences to convert again: the code and rule tables a conversion
+depended on and which sentences hold which lemmas, upos and deprels, recorded next to its output by
+save_dependencies() and compared with the current ones by affected_sentences(). splice_sentences() then puts the
+sentences converted again in place in the output.
+'''
+import os
+import json
+import hashlib
+import inspect
+
+import utils
+
+
+def splice_sentences(path, replacements):
+    '''
+    replaces in the converted file in path the sentences whose sent_id is a key of replacements with the
+    corresponding text, leaving all other sentences untouched.
+    '''
+    with utils.atomic_file(path) as out, open(path, encoding='utf8') as f:
+        for text in utils.raw_sentences(f):
+            out.write(replacements.get(utils.sentence_id(text), text))
+
+
+def code_fingerprint(*objects):
+    '''
+    a hash of the source code of the given modules, classes and functions, and of the repr of anything else.
+    '''
+    digest = hashlib.sha256()
+    for obj in objects:
+        if inspect.ismodule(obj) or inspect.isclass(obj) or inspect.isfunction(obj):
+            digest.update(inspect.getsource(obj).encode())
+        else:
+            digest.update(repr(obj).encode())
+    return digest.hexdigest()
+
+
+def tables_snapshot(tables):
+    '''
+    the rule tables in a form that can be compared and stored as json: every table becomes a dict from its keys (or
+    members, for sets and lists) to the repr of their values.
+    :param tables: a dict from table names to (kind, table), where kind is the column the keys of the table come from
+                   ('lemma', 'upos' or 'deprel')
+    '''
+    snapshot = {}
+    for name, (kind, table) in tables.items():
+        if isinstance(table, dict):
+            snapshot[name] = {str(key): repr(value) for key, value in table.items()}
+        else:
+            snapshot[name] = {str(key): '' for key in table}
+    return snapshot
+
+
+def sentence_words(parse_list):
+    '''
+    the lemmas, upos and deprels of a sentence, as read before it is converted.
+    :return: a dict of form {'lemma': {lemma, ...}, 'upos': {...}, 'deprel': {...}}
+    '''
+    words = {kind: {str(token[kind]) for token in parse_list} for kind in ('lemma', 'upos', 'deprel')}
+    # tables are looked up by the lemmas of fixed expressions too
+    words['lemma'].update(utils.fixed_expressions(parse_list).values())
+    return words
+
+
+class SentenceIndexer:
+    '''
+    Builds the index of sentence_index() one sentence at a time, so a conversion can index the sentences it converts
+    instead of reading its input again.
+    '''
+    def __init__(self):
+        self.index = {'lemma': {}, 'upos': {}, 'deprel': {}} # None once a sentence has no sent_id
+
+    def add(self, sent_id, words):
+        '''
+        adds the sentence sent_id, holding words (see sentence_words()), to the index.
+        '''
+        if sent_id is None:
+            self.index = None
+        if self.index is None:
+            return
+        for kind, values in words.items():
+            column = self.index[kind]
+            for value in values:
+                column.setdefault(value, []).append(sent_id)
+
+    def indexed(self, parse_lists):
+        '''
+        yields the sentences of parse_lists, each added to the index before it is yielded and so before it is converted.
+        '''
+        for parse_list in parse_lists:
+            self.add(parse_list.metadata.get('sent_id'), sentence_words(parse_list))
+            yield parse_list
+
+
+def sentence_index(parse_lists):
+    '''
+    an index from every lemma, upos and deprel to the ids of the sentences in which it appears.
+    :return: a dict of form {'lemma': {lemma: [sent_id, ...]}, 'upos': {...}, 'deprel': {...}}, or None if a sentence
+             has no sent_id
+    '''
+    indexer = SentenceIndexer()
+    for _ in indexer.indexed(parse_lists):
+        pass
+    return indexer.index
+
+
+def dependencies_record(input_key, code, tables, index):
+    '''
+    what a conversion depended on: its input, its code, its rule tables and which sentences hold which lemmas, upos and
+    deprels (see affected_sentences()).
+    '''
+    return {'input': input_key, 'code': code, 'kinds': {name: kind for name, (kind, _) in tables.items()},
+            'tables': tables_snapshot(tables), 'index': index}
+
+
+def save_dependencies(path, input_key, code, tables, index):
+    '''
+    stores in the json file in path what a conversion depended on: its input, its code, its rule tables and which
+    sentences hold which lemmas, upos and deprels.
+    '''
+    dependencies = dependencies_record(input_key, code, tables, index)
+    utils.atomic_write(path, lambda f: json.dump(dependencies, f, ensure_ascii=False))
+
+
+def load_dependencies(path):
+    '''
+    what the conversion recorded in the json file in path depended on (see save_dependencies()), or None.
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+
+def affected_sentences(dependencies, input_key, code, tables):
+    '''
+    the ids of the sentences whose conversion may change since the conversion that had dependencies (see
+    load_dependencies()), because an entry of one of the rule tables changed and they hold a lemma, upos or deprel it
+    is keyed by. Entries keyed by several words (fixed expressions) affect the sentences holding any of them.
+    :return: a set of sentence ids, or None if everything has to be converted again: nothing was recorded, or the input,
+             the code or the set of tables changed
+    '''
+    if dependencies is None or dependencies['index'] is None:
+        return None
+    kinds = {name: kind for name, (kind, _) in tables.items()}
+    if (dependencies['input'], dependencies['code'], dependencies['kinds']) != (input_key, code, kinds):
+        return None
+
+    affected = set()
+    snapshot = tables_snapshot(tables)
+    for name, kind in kinds.items():
+        old, new = dependencies['tables'][name], snapshot[name]
+        for key in old.keys() | new.keys():
+            if old.get(key) != new.get(key):
+                for word in key.split() if kind == 'lemma' else [key]:
+                    affected.update(dependencies['index'][kind].get(word, []))
+    return affected
@@ -0,0 +1,84 @@
+'''
+A logging mode for the Italian pipeline that keeps the cost of logging off the conversion:
+- records go through a QueueHandler to a thread that writes them to the log file. Their messages are still formatted
+  on the converting thread, when the QueueHandler prepares them, as the tokens they print are changed by later rules
+- only the first warnings of every rule (a logging call, by module and line) are written, the rest are counted and
+  summed up at the end of the log
+- debug and info records are only kept for a sample of the sentences, chosen by their sent_id so that every run traces
+  the same ones. For the other sentences the loggers are set to WARNING, so their debug calls cost a level check.
+'''
+import zlib
+import queue
+import logging
+import logging.handlers
+import collections
+
+FORMAT = '[%(module)s:%(lineno)d] %(levelname)s:%(message)s'
+SAMPLE_BUCKETS = 10000
+
+
+class RepeatedWarnings(logging.Filter):
+	'''
+	lets through the first keep warnings of every rule and counts all of them.
+	'''
+	def __init__(self, keep=1):
+		super().__init__()
+		self.keep = keep
+		self.counts = collections.Counter()
+		self.messages = {}
+
+	def filter(self, record):
+		if record.levelno != logging.WARNING:
+			return True
+		rule = (record.module, record.lineno)
+		self.counts[rule] += 1
+		self.messages.setdefault(rule, record.msg)
+		return self.counts[rule] <= self.keep
+
+
+class QueuedLog:
+	'''
+	sends the records of all the loggers to path through a queue, until stop() is called.
+	'''
+	def __init__(self, path, sample=1.0, keep_warnings=1):
+		self.sample = sample
+		self.file_handler = logging.FileHandler(path, mode='w', encoding='utf-8')
+		self.file_handler.setFormatter(logging.Formatter(FORMAT))
+		records = queue.SimpleQueue()
+		self.listener = logging.handlers.QueueListener(records, self.file_handler)
+		self.warnings = RepeatedWarnings(keep_warnings)
+		self.queue_handler = logging.handlers.QueueHandler(records)
+		self.queue_handler.addFilter(self.warnings) # before the queue, so dropped warnings are never formatted
+
+		root = logging.getLogger()
+		for handler in root.handlers[:]:
+			root.removeHandler(handler)
+		root.addHandler(self.queue_handler)
+		root.setLevel(logging.DEBUG)
+		self.listener.start()
+
+	def sampled(self, sent_id):
+		return self.sample >= 1 or zlib.crc32(sent_id.encode('utf-8')) % SAMPLE_BUCKETS < self.sample * SAMPLE_BUCKETS
+
+	def start_sentence(self, sent_id):
+		'''
+		traces the sentence sent_id in full if it is in the sample, and only logs its warnings and errors otherwise.
+		'''
+		level = logging.DEBUG if self.sampled(sent_id) else logging.WARNING
+		root = logging.getLogger()
+		if root.level != level:
+			root.setLevel(level)
+
+	def stop(self):
+		'''
+		writes how often every repeated warning was logged, then waits for the queue to be written and closes the log.
+		'''
+		self.queue_handler.removeFilter(self.warnings)
+		logging.getLogger().setLevel(logging.DEBUG)
+		for (module, lineno), count in self.warnings.counts.most_common():
+			if count > self.warnings.keep:
+				logging.warning("[%s:%d] %s: logged %d times, %d not written",
+					module, lineno, self.warnings.messages[(module, lineno)], count, count - self.warnings.keep)
+		self.listener.stop()
+		logging.getLogger().removeHandler(self.queue_handler)
+		self.file_handler.close()
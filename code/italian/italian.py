@@ -1,10 +1,13 @@
 """
 usage (launch from msap-docs directory):
-python -m code.italian.italian SOURCE_TREEBANK.conllu OUTPUT_FILEPATH
+python -m code.italian.italian SOURCE_TREEBANK.conllu OUTPUT_FILEPATH [--queued-log [--sample RATE] [--keep-warnings N]]
 
 e.g.
 
 python -m code.italian.italian data/italian/dev.conllu data/italian/dev.out.conllu
+
+--queued-log writes the log from a background thread, writes only the first warnings of every rule and, with --sample,
+traces only a share of the sentences (see ita_logging.py)
 """
 import logging
 import collections
@@ -13,157 +16,194 @@ import code.italian.verbs as verbs
 import code.italian.nouns as nouns
 import code.italian.adjs as adjs
 import code.italian.advs as advs
+import code.italian.ita_logging as ita_logging
 import conllu
 
 
 def DFS(root_tree):
+	'''
+	yields (head, children) as tokens for every head of the tree, children first (see utils.post_order()).
+	'''
+	for tree, children in utils.post_order(root_tree, lambda tree: tree.children):
+		yield tree.token, [child.token for child in children]
+
+
+def classify(token):
+	'''
+	what build_tree does with a token: "dropped" for multiword tokens, empty nodes, punctuation and reparanda,
+	"fixed" for the parts of fixed expressions, which are combined into their heads, and "kept" for the rest.
+	'''
+	if not isinstance(token['id'], int) or token['upos'] == "PUNCT" or token['deprel'] in {"punct", "reparandum"}:
+		return "dropped"
+	if token['deprel'] == "fixed":
+		return "fixed"
+	return "kept"
+
+
+def build_tree(tokenlist):
+	'''
+	prepares the nodes of a sentence for the rules and builds the tree they are applied to: without punctuation,
+	reparanda and the fixed parts of fixed expressions, whose lemmas are in utils.fixed_expressions() instead.
+	'''
+	# every token is classified once, in the order of the sentence, and the tree is built from the tokens kept
+	kept, fixed_nodes, not_dropped = [], [], []
+	for node in tokenlist:
+		node["ms feats"] = collections.defaultdict(set)
+		node["content"] = False
+		kind = classify(node)
+		if kind == "kept":
+			kept.append(node)
+		elif kind == "fixed":
+			fixed_nodes.append(node)
+		if kind != "dropped":
+			not_dropped.append(node)
+	filtered_tokenlist = conllu.TokenList(kept, metadata=tokenlist.metadata)
+
+	if logging.root.isEnabledFor(logging.DEBUG):
+		logging.debug("Removed punctuation: %s", " ".join([str(x) for x in not_dropped]))
+
+	if fixed_nodes and logging.root.isEnabledFor(logging.DEBUG):
+		logging.debug("Removed fixed deprels: %s", " | ".join([str(x) for x in filtered_tokenlist]))
+
+
+	# TODO: split parataxis?
+
+	tree = filtered_tokenlist.to_tree()
+	return tree
+
+
+def apply_rules(tree, fixed_lemmas=None):
+	'''
+	applies the rules of every part of speech to every head of the tree, children first.
+	fixed_lemmas are the multiword lemmas of the fixed expressions of the sentence (see utils.fixed_expressions()).
+	'''
+	# heads = utils.span(tree)
+	# print(heads)
+	# heads_dict = {}
+	# for element in heads:
+	# 	head, children = element
+	# 	heads_dict[head] = children
+
+	# assert utils.verify_span(heads) #TODO: a che serve?
+
+
+	# for head, children in heads_dict.items():
+	for head_tok, children_toks in DFS(tree):
+		# head_tok = tokenlist[id2idx[head]]
+		# children_toks = [tokenlist[id2idx[child]] for child in children]
+
+		# remove parataxis
+		children_toks = [tok for tok in children_toks if tok["deprel"] != "parataxis"]
+
+
+		if logging.root.isEnabledFor(logging.INFO): # not to join the children when sentences are not traced
+			logging.info("Processing head (%s/%s) with children (%s)",
+			 head_tok, head_tok["upos"], " | ".join(str(x) for x in children_toks))
+
+		# TODO: check case of ADPs
+		head_tok["content"] = True
+
+		if head_tok["upos"] in ["VERB"]:
+			verbs.process_verb(head_tok, children_toks)
+		elif head_tok["upos"] in ["NOUN", "PROPN"]:
+			nouns.process_noun(head_tok, children_toks, fixed_lemmas)
+		elif head_tok["upos"] in ["ADJ"]:
+			adjs.process_adj(head_tok, children_toks)
+		elif head_tok["upos"] in ["ADV"]:
+			advs.process_adv(head_tok, children_toks)
+		else:
+			logging.warning("Found head (%s) with PoS %s, children (%s)",
+			 head_tok, head_tok["upos"], " | ".join(str(x) for x in children_toks))
+			#TODO: NUM?
+			#TODO: PRON?
+
+
+def finish(tokenlist):
+	'''
+	writes the ms-feats of the content nodes of the sentence as strings.
+	'''
+	for node in tokenlist:
+
+		if node["content"]:
+			if node.get("feats"):
+				node_feats = node['feats']
+				node_msfeats = node["ms feats"]
+
+				for feat, value in node["feats"].items():
+					if feat in node["ms feats"]:
+						assert any(x==node["feats"][feat] for x in node["ms feats"][feat])
+					else:
+						node["ms feats"][feat].add(node["feats"][feat])
+
+			sorted_msfeats = sorted(node["ms feats"].items())
+			sorted_msfeats = [f"{x}={','.join(y)}" for x, y in sorted_msfeats]
+			node['ms feats'] = "|".join(sorted_msfeats)
+
+		elif node.get("ms feats"):
+			logging.error("Node %s should be empty bus has features %s", node, node["ms feats"])
+			node["ms feats"] = None
+
+
+def convert_sentence(tokenlist):
+	'''
+	converts one sentence and returns it serialized with its ms-feats.
+	'''
+	tree = build_tree(tokenlist)
+	apply_rules(tree, utils.fixed_expressions(tokenlist))
+	finish(tokenlist)
+	return tokenlist.serialize()
 
-	if root_tree.children:
-		children = root_tree.children
-		for child in children:
-			# print(child)
-			yield from DFS(child)
-		yield(root_tree.token, [child.token for child in children])
-	# else:
-	# 	yield(root_tree.token, None)
-
-	# else:
-	# 	return
-		# return root_tree.token, [tok.token for tok in root_tree.children]
-		# process_vertex(root_tree)
-	# else:
-	# 	pass
 
 if __name__ == '__main__':
-	import sys
+	import argparse
 	import pathlib
 
-	filepath = pathlib.Path(sys.argv[1])
-	out_path = pathlib.Path(sys.argv[2])
+	parser = argparse.ArgumentParser()
+	parser.add_argument('source', type=pathlib.Path, help='the treebank to convert')
+	parser.add_argument('output', type=pathlib.Path, help='where to write the converted treebank')
+	parser.add_argument('--queued-log', action='store_true',
+						help='write the log from a background thread and count repeated warnings instead of writing them')
+	parser.add_argument('--sample', type=float, default=1.0,
+						help='with --queued-log, the share of the sentences whose debug and info records are kept (default: 1)')
+	parser.add_argument('--keep-warnings', type=int, default=1,
+						help='with --queued-log, how many warnings of every rule are written (default: 1)')
+	args = parser.parse_args()
+	filepath, out_path = args.source, args.output
+	log_path = f"logs/italian/{filepath.stem}.log"
 
 	logger = logging.getLogger(__name__)
-	logging.basicConfig(format='[%(module)s:%(lineno)d] %(levelname)s:%(message)s',
-					filename=f"logs/italian/{filepath.stem}.log",
-					filemode='w', encoding='utf-8',
-					level=logging.DEBUG)
+	if args.queued_log:
+		queued_log = ita_logging.QueuedLog(log_path, args.sample, args.keep_warnings)
+	else:
+		queued_log = None
+		logging.basicConfig(format=ita_logging.FORMAT,
+						filename=log_path,
+						filemode='w', encoding='utf-8',
+						level=logging.DEBUG)
 
 	logging.info("Processing %s into %s", filepath, out_path)
 
-	with open(filepath, encoding='utf8') as f:
-		parse_trees = list(conllu.parse_tree_incr(f))
-
-	with open(filepath, encoding='utf8') as f:
-		parse_lists = list(conllu.parse_incr(f))
+	# the tree is rebuilt in build_tree() from the filtered token list, so a single parse of the token lists is enough
+	with open(filepath, encoding='utf8') as f, open(out_path, "w", encoding="utf-8") as fout:
 
-	with open(out_path, "w", encoding="utf-8") as fout:
-
-		for tree, tokenlist in zip(parse_trees, parse_lists):
+		for tokenlist in utils.parse_incr(f):
+			if queued_log:
+				queued_log.start_sentence(tokenlist.metadata["sent_id"])
 			logging.info("Processing sentence id: %s", tokenlist.metadata["sent_id"])
 			logging.debug("Processing sentence: %s", tokenlist.metadata["text"])
 			# print(tokenlist.metadata["text"])
 
-			for node in tokenlist:
-				node["ms feats"] = collections.defaultdict(set)
-				node["content"] = False
-
-			id2idx = {token['id']:i for i, token in enumerate(tokenlist)}
-			idx2id = {y:x for x, y in id2idx.items()}
-
-			# filter out useless nodes (punct, reparandum)
-			filtered_tokenlist = tokenlist \
-								.filter(id=lambda x: isinstance(x, int)) \
-								.filter(upos=lambda x: x!="PUNCT") \
-								.filter(deprel=lambda x: x != "punct") \
-								.filter(deprel=lambda x: x != "reparandum")
-			logging.debug("Removed punctuation: %s", " ".join([str(x) for x in filtered_tokenlist]))
-
-			# combine fixed expressions
-			fixed_nodes = filtered_tokenlist.filter(deprel="fixed")
-			filtered_tokenlist = filtered_tokenlist.filter(deprel=lambda x: x!= "fixed")
-
-			if len(fixed_nodes):
-				fixed_nodes_sorted = sorted(fixed_nodes, key=lambda x: x['id'])
-				for node in fixed_nodes_sorted:
-					node_head = tokenlist[id2idx[node['head']]]
-					node_head["lemma"] += f" {node['lemma']}"
-					node_head["form"] += f" {node['form']}"
-
-				logging.debug("Removed fixed deprels: %s", " | ".join([str(x) for x in filtered_tokenlist]))
-
-
-			# TODO: split parataxis?
-
-			tree = filtered_tokenlist.to_tree()
-			# print(tree.token)
-			# input()
-
-			# heads = utils.span(tree)
-			# print(heads)
-			# heads_dict = {}
-			# for element in heads:
-			# 	head, children = element
-			# 	heads_dict[head] = children
-
-			# assert utils.verify_span(heads) #TODO: a che serve?
-
-
-			# for head, children in heads_dict.items():
-			for head_tok, children_toks in DFS(tree):
-				# head_tok = tokenlist[id2idx[head]]
-				# children_toks = [tokenlist[id2idx[child]] for child in children]
-
-				# remove parataxis
-				children_toks = [tok for tok in children_toks if tok["deprel"] != "parataxis"]
-
-
-				logging.info("Processing head (%s/%s) with children (%s)",
-				 head_tok, head_tok["upos"], " | ".join(str(x) for x in children_toks))
-
-				# TODO: check case of ADPs
-				head_tok["content"] = True
-
-				if head_tok["upos"] in ["VERB"]:
-					verbs.process_verb(head_tok, children_toks)
-				elif head_tok["upos"] in ["NOUN", "PROPN"]:
-					nouns.process_noun(head_tok, children_toks)
-				elif head_tok["upos"] in ["ADJ"]:
-					adjs.process_adj(head_tok, children_toks)
-				elif head_tok["upos"] in ["ADV"]:
-					advs.process_adv(head_tok, children_toks)
-				else:
-					logging.warning("Found head (%s) with PoS %s, children (%s)",
-					 head_tok, head_tok["upos"], " | ".join(str(x) for x in children_toks))
-					#TODO: NUM?
-					#TODO: PRON?
-
-			for node in tokenlist:
-
-				# restore original lemma
-				node['lemma'] = node['lemma'].split(" ")[0]
-				node['form'] = node['form'].split(" ")[0]
-
-				if node["content"]:
-					if node.get("feats"):
-						node_feats = node['feats']
-						node_msfeats = node["ms feats"]
-
-						for feat, value in node["feats"].items():
-							if feat in node["ms feats"]:
-								assert any(x==node["feats"][feat] for x in node["ms feats"][feat])
-							else:
-								node["ms feats"][feat].add(node["feats"][feat])
-
-					sorted_msfeats = sorted(node["ms feats"].items())
-					sorted_msfeats = [f"{x}={','.join(y)}" for x, y in sorted_msfeats]
-					node['ms feats'] = "|".join(sorted_msfeats)
-
-				elif node.get("ms feats"):
-					logging.error("Node %s should be empty bus has features %s", node, node["ms feats"])
-					node["ms feats"] = None
-
-			to_write = tokenlist.serialize()
+			try:
+				to_write = convert_sentence(tokenlist)
+			except Exception:
+				if queued_log:
+					queued_log.stop() # not to lose the records still in the queue
+				raise
 			print(to_write, file=fout)
 
+	if queued_log:
+		queued_log.stop()
+
 
 	# with open(out_path, 'w', encoding='utf8') as outfile:
 	#     for i in range(len(parse_trees)): # iterate over the sentences
@@ -1,2 +1,4 @@
-def switch_nominal_case(token):
-	return f"TBD-{token['lemma']}"
+def switch_nominal_case(token, fixed_lemmas=None):
+	# the head of a fixed expression stands for the whole expression
+	lemma = fixed_lemmas.get(token['id'], token['lemma']) if fixed_lemmas else token['lemma']
+	return f"TBD-{lemma}"
@@ -5,7 +5,7 @@ import code.italian.ita_utils as ita_utils
 
 logger = logging.getLogger(__name__)
 
-def process_noun(head_tok, children_toks):
+def process_noun(head_tok, children_toks, fixed_lemmas=None):
 
 	logger.debug("Examining head: %s", head_tok)
 
@@ -34,8 +34,8 @@ def process_noun(head_tok, children_toks):
 
 		# case relations
 		elif child_tok["deprel"] == "case":
-			logger.debug("Adding Case feature with value %s", lbd.switch_nominal_case(child_tok))
-			head_tok["ms feats"]["Case"].add(lbd.switch_nominal_case(child_tok))
+			logger.debug("Adding Case feature with value %s", lbd.switch_nominal_case(child_tok, fixed_lemmas))
+			head_tok["ms feats"]["Case"].add(lbd.switch_nominal_case(child_tok, fixed_lemmas))
 
 		elif child_tok["upos"] in ["NOUN", "PROPN"]:
 			logger.debug("Switching node to content and keeping its features")
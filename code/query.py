@@ -0,0 +1,297 @@
+'''
+Answers grew-style questions about a treebank, like the ones in italian/notes.md, without scanning it by hand.
+A TreebankIndex keeps inverted indexes over the form, lemma, upos, xpos, deprel and feats of every token, so a pattern
+only looks at the tokens that can match it.
+
+Patterns are a subset of grew's:
+    pattern { e: X -> Y; Y[upos=SYM] }
+    pattern { X -[nsubj|obj]-> Y; X[upos=VERB, Mood=Ind]; Y[lemma<>io] }
+    X -[^punct]-> Y; X[upos=NOUN|PROPN, !Number]
+
+- X -> Y is an edge from a head to its dependent, with an optional name (e:) that is ignored.
+  X -[a|b]-> Y restricts the deprel of the dependent, X -[^a|b]-> Y excludes deprels.
+- X[...] constrains a node by form, lemma, upos, xpos, deprel or any feature: name=a|b (one of the values),
+  name<>a|b or name!=a|b (none of them), name (has the feature) and !name (does not have it). A ! before a
+  comparison negates it: !name=a|b is name<>a|b.
+- All nodes of a match are distinct tokens of one sentence. Matches are counted like grew does, once per assignment of
+  tokens to nodes.
+
+usage:
+python code/query.py treebank.conllu 'pattern { e: X -> Y; X[upos=SYM] }' [more patterns] [--ids] [--cache DIR]
+'''
+import os
+import re
+import pickle
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, Counter
+
+import utils
+
+FIELDS = ['form', 'lemma', 'upos', 'xpos', 'deprel']
+
+
+class TreebankIndex:
+    '''
+    All the tokens of a treebank, numbered in order, with the sentence and the head of every token and an inverted
+    index from every field value and every feature (as 'Name=Value') to the sorted numbers of the tokens that have it.
+    Multiword tokens and empty nodes are left out.
+    '''
+    def __init__(self, parse_lists):
+        self.sent_ids = []
+        self.sent_starts = array('i') # the number of the first token of every sentence
+        self.sentences = array('i') # the sentence of every token
+        self.heads = array('i') # the number of the head of every token, -1 for roots
+        self.child_starts = array('i') # the children of token t are child_numbers[child_starts[t]:child_starts[t + 1]]
+        self.child_numbers = array('i')
+        self.values = {field: [] for field in FIELDS}
+        self.feats = []
+        self.index = {field: defaultdict(list) for field in FIELDS + ['feats']}
+
+        children = []
+        for parse_list in parse_lists:
+            start = len(self.sentences)
+            self.sent_ids.append(parse_list.metadata.get('sent_id'))
+            self.sent_starts.append(start)
+            tokens = [token for token in parse_list if isinstance(token['id'], int)]
+            numbers = {token['id']: start + i for i, token in enumerate(tokens)}
+            for token in tokens:
+                number = len(self.sentences)
+                self.sentences.append(len(self.sent_ids) - 1)
+                self.heads.append(numbers.get(token['head'], -1))
+                children.append([])
+                for field in FIELDS:
+                    self.values[field].append(token[field])
+                    self.index[field][token[field]].append(number)
+                self.feats.append(token['feats'] or {})
+                for name, value in (token['feats'] or {}).items():
+                    self.index['feats'][f'{name}={value}'].append(number)
+                    self.index['feats'][name].append(number)
+            for number in range(start, len(self.sentences)):
+                if self.heads[number] >= 0:
+                    children[self.heads[number]].append(number)
+        self.sent_starts.append(len(self.sentences))
+
+        for token_children in children:
+            self.child_starts.append(len(self.child_numbers))
+            self.child_numbers.extend(token_children)
+        self.child_starts.append(len(self.child_numbers))
+        self.index = {field: dict(index) for field, index in self.index.items()}
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def children(self, number):
+        return self.child_numbers[self.child_starts[number]:self.child_starts[number + 1]]
+
+    def lookup(self, name, value):
+        '''
+        the numbers of the tokens whose field or feature name has value.
+        '''
+        if name in FIELDS:
+            return self.index[name].get(value, [])
+        return self.index['feats'].get(f'{name}={value}', [])
+
+    def value(self, name, number):
+        if name in FIELDS:
+            return self.values[name][number]
+        return self.feats[number].get(name)
+
+    def match(self, pattern):
+        '''
+        :param pattern: a Pattern or the text of one
+        :return: a Counter of the matches of pattern in every sentence, by sent_id
+        '''
+        if isinstance(pattern, str):
+            pattern = Pattern(pattern)
+        candidates = {name: self.candidates(pattern, name) for name in pattern.nodes}
+        order = pattern.search_order({name: len(numbers) for name, numbers in candidates.items()})
+        # None stands for all tokens, so no set of all the tokens of the treebank is built
+        members = {name: None if isinstance(numbers, range) else set(numbers) for name, numbers in candidates.items()}
+
+        matches = Counter()
+        first = order[0]
+        for number in candidates[first]:
+            sentence = self.sentences[number]
+            count = self.count_matches(pattern, order, 1, {first: number}, sentence, candidates, members)
+            if count:
+                matches[self.sent_ids[sentence]] += count
+        return matches
+
+    def candidates(self, pattern, name):
+        '''
+        the sorted numbers of the tokens that satisfy the constraints on the node name and on the deprels of its edges
+        from its head, using the indexes where the constraints allow it.
+        '''
+        constraints = list(pattern.nodes[name])
+        for head, dependent, deprels, negated in pattern.edges:
+            if dependent == name and deprels is not None:
+                constraints.append(('deprel', '<>' if negated else '=', deprels))
+
+        numbers = None
+        for field, operator, values in constraints:
+            if operator == '=':
+                found = set()
+                for value in values:
+                    found.update(self.lookup(field, value))
+            elif operator == 'has':
+                found = set(self.index['feats'].get(field, []))
+            else:
+                continue
+            numbers = found if numbers is None else numbers & found
+        numbers = range(len(self)) if numbers is None else sorted(numbers)
+
+        checks = [(field, operator, values) for field, operator, values in constraints if operator in {'<>', 'not'}]
+        if checks:
+            numbers = [number for number in numbers if all(
+                (self.value(field, number) not in values) if operator == '<>' else (self.value(field, number) is None)
+                for field, operator, values in checks)]
+        return numbers
+
+    def count_matches(self, pattern, order, step, bound, sentence, candidates, members):
+        if step == len(order):
+            return 1
+        name = order[step]
+        numbers = None
+        for head, dependent, deprels, negated in pattern.edges:
+            if dependent == name and head in bound:
+                numbers = [child for child in self.children(bound[head])
+                           if members[name] is None or child in members[name]]
+                break
+            if head == name and dependent in bound:
+                head_number = self.heads[bound[dependent]]
+                numbers = [head_number] if head_number >= 0 and (members[name] is None or head_number in members[name]) else []
+                break
+        if numbers is None: # not connected to the nodes bound so far, so any candidate of the same sentence
+            numbers = candidates[name]
+            start = bisect_left(numbers, self.sent_starts[sentence])
+            end = bisect_left(numbers, self.sent_starts[sentence + 1])
+            numbers = numbers[start:end]
+
+        count = 0
+        for number in numbers:
+            if number in bound.values():
+                continue
+            bound[name] = number
+            if all(self.heads[bound[dependent]] == bound[head] for head, dependent, _, _ in pattern.edges
+                   if head in bound and dependent in bound):
+                count += self.count_matches(pattern, order, step + 1, bound, sentence, candidates, members)
+            del bound[name]
+        return count
+
+
+class Pattern:
+    '''
+    A parsed pattern: its nodes, each with a list of (name, operator, values) constraints, and its edges, each a tuple
+    (head, dependent, deprels or None, negated).
+    '''
+    edge_re = re.compile(r'^(?:\w+\s*:\s*)?(\w+)\s*-(?:\[(\^?)([^\]]*)\]-)?>\s*(\w+)$')
+    node_re = re.compile(r'^(\w+)\s*\[(.*)\]$')
+    constraint_re = re.compile(r'^(!?)([\w:]+)\s*(?:(=|<>|!=)\s*(.+))?$')
+    negated_operators = {'=': '<>', '<>': '='}
+
+    def __init__(self, text):
+        self.text = text
+        self.nodes = {}
+        self.edges = []
+        body = text.strip()
+        if body.startswith('pattern'):
+            body = body[len('pattern'):].strip()
+        if body.startswith('{') and body.endswith('}'):
+            body = body[1:-1]
+
+        for clause in re.split(r'[;\n]', body):
+            clause = clause.strip()
+            if not clause:
+                continue
+            edge = self.edge_re.match(clause)
+            node = self.node_re.match(clause)
+            if edge:
+                head, negated, deprels, dependent = edge.groups()
+                self.nodes.setdefault(head, [])
+                self.nodes.setdefault(dependent, [])
+                deprels = {deprel.strip() for deprel in deprels.split('|')} if deprels else None
+                self.edges.append((head, dependent, deprels, bool(negated)))
+            elif node:
+                name, constraints = node.groups()
+                self.nodes.setdefault(name, []).extend(self.parse_constraints(constraints))
+            else:
+                raise ValueError(f'can not parse "{clause}" in pattern "{text}"')
+        if not self.nodes:
+            raise ValueError(f'no nodes in pattern "{text}"')
+
+    def parse_constraints(self, text):
+        constraints = []
+        for part in text.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            constraint = self.constraint_re.match(part)
+            if not constraint:
+                raise ValueError(f'can not parse the constraint "{part}" in pattern "{self.text}"')
+            negated, name, operator, values = constraint.groups()
+            if operator == '!=':
+                operator = '<>'
+            if operator and negated: # !name=a is name<>a, !name<>a is name=a
+                operator = self.negated_operators[operator]
+            if operator:
+                constraints.append((name, operator, {value.strip() for value in values.split('|')}))
+            else:
+                constraints.append((name, 'not' if negated else 'has', None))
+        return constraints
+
+    def search_order(self, sizes):
+        '''
+        the order to bind the nodes in: the node with the fewest candidates first, then always a node next to the ones
+        already bound (following the edges), choosing the one with the fewest candidates.
+        '''
+        order = []
+        while len(order) < len(self.nodes):
+            remaining = [name for name in self.nodes if name not in order]
+            neighbours = [name for name in remaining if any(
+                (head == name and dependent in order) or (dependent == name and head in order)
+                for head, dependent, _, _ in self.edges)]
+            order.append(min(neighbours or remaining, key=lambda name: sizes[name]))
+        return order
+
+
+def load_index(path, cache_dir=None):
+    '''
+    the TreebankIndex of the conllu file in path. With a cache_dir, the index is stored there and loaded from there as
+    long as the file and the parser are unchanged (see utils.parse_cache_key()).
+    '''
+    if cache_dir is None:
+        with open(path, encoding='utf8') as f:
+            return TreebankIndex(utils.parse_incr(f))
+
+    cache_path = os.path.join(cache_dir, f'{os.path.basename(path)}.{utils.parse_cache_key(path)[:16]}.index.pickle')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    with open(path, encoding='utf8') as f:
+        index = TreebankIndex(utils.parse_incr(f))
+    os.makedirs(cache_dir, exist_ok=True)
+    utils.atomic_write(cache_path, lambda f: pickle.dump(index, f, pickle.HIGHEST_PROTOCOL), binary=True)
+    return index
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('treebank', help='the conllu file to query')
+    parser.add_argument('patterns', nargs='+', help='grew-style patterns, e.g. \'pattern { e: X -> Y; Y[upos=SYM] }\'')
+    parser.add_argument('--ids', action='store_true', help='also list the matching sentences with their counts')
+    parser.add_argument('--cache', metavar='DIR', help='keep the index of the treebank in DIR for the next queries')
+    args = parser.parse_args()
+
+    index = load_index(args.treebank, args.cache)
+    for pattern in args.patterns:
+        start = time.perf_counter()
+        matches = index.match(pattern)
+        took = (time.perf_counter() - start) * 1000
+        print(f'{pattern}\n{sum(matches.values())} occurrences in {len(matches)} sentences ({took:.1f} ms)')
+        if args.ids:
+            for sent_id, count in matches.items():
+                print(f'\t{sent_id}\t{count}')
@@ -0,0 +1,146 @@
+'''
+The feature values of inventory.md as an indexed registry, so that validators and rule packs can check values against
+the inventory without reading the markdown.
+
+The table of inventory.md is parsed once into a FeatureRegistry, which is stored as a pickle in code/__pycache__ and
+loaded from there as long as the markdown is unchanged.
+
+    registry = load_registry()
+    'Ine' in registry                       # True
+    registry.values['Ine']                  # ('Static location',)
+    registry.categories['Static location']  # ('Loc', 'Ine', 'Ces', ...)
+    registry.exponents['English']['Ine']    # ('in', 'inside', ...)
+    registry.by_exponent['English']['in']   # ('Ine', ...)
+'''
+import os
+import re
+import pickle
+import hashlib
+
+import utils
+
+INVENTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'inventory.md')
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+REGISTRY_FORMAT = 1 # bump when FeatureRegistry changes, so registries cached before are built again
+
+category_re = re.compile(r'^\*__(.*?)__\*')
+# the columns describing a value; all the columns after them are languages
+DESCRIPTION_COLUMNS = ['FValue', 'Name', 'Other names', 'Short description',
+                       'Languages where it is attested as morphological case']
+
+
+class FeatureRegistry:
+    '''
+    The rows of the inventory, indexed:
+    values       value -> the categories it is listed under, in the order of the table (a value may be listed twice,
+                 e.g. Exe as exelative and as exessive)
+    categories   category -> its values
+    descriptions value -> a list of dicts of its name, other names, short description and attested languages, one per
+                 row
+    languages    the languages of the table
+    exponents    language -> value -> its exponents in the language (e.g. 'do+Gen')
+    by_exponent  language -> exponent -> the values it expresses
+    '''
+    def __init__(self, lines):
+        self.values = {}
+        self.categories = {}
+        self.descriptions = {}
+        self.exponents = {}
+        self.by_exponent = {}
+
+        rows = [[cell.strip() for cell in line.strip().strip('|').split('|')] for line in lines if line.count('|') > 2]
+        header, rows = rows[0], rows[2:] # the second row only underlines the header
+        self.languages = tuple(header[len(DESCRIPTION_COLUMNS):])
+        for language in self.languages:
+            self.exponents[language] = {}
+            self.by_exponent[language] = {}
+
+        category = None
+        for row in rows:
+            value = row[0]
+            heading = category_re.match(value)
+            if heading:
+                category = heading.group(1).strip()
+                self.categories.setdefault(category, ())
+                continue
+            if not value:
+                continue
+            if category not in self.values.get(value, ()):
+                self.values[value] = self.values.get(value, ()) + (category,)
+                self.categories[category] = self.categories.get(category, ()) + (value,)
+            name, other_names, description, attested = (row + [''] * len(DESCRIPTION_COLUMNS))[1:len(DESCRIPTION_COLUMNS)]
+            self.descriptions.setdefault(value, []).append({
+                'name': name, 'other names': other_names, 'description': description,
+                'attested': [language.strip() for language in attested.split(',') if language.strip()]})
+            for language, cell in zip(self.languages, row[len(DESCRIPTION_COLUMNS):]):
+                exponents = tuple(exponent.strip() for exponent in cell.split(',') if exponent.strip())
+                if not exponents:
+                    continue
+                self.exponents[language][value] = self.exponents[language].get(value, ()) + exponents
+                for exponent in exponents:
+                    if value not in self.by_exponent[language].get(exponent, ()):
+                        self.by_exponent[language][exponent] = self.by_exponent[language].get(exponent, ()) + (value,)
+
+    def __contains__(self, value):
+        return value in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+
+def inventory_key(content):
+    '''
+    a hash of the content of inventory.md and of the registry format.
+    '''
+    return hashlib.sha256(f'registry format {REGISTRY_FORMAT}\n'.encode() + content).hexdigest()
+
+
+def load_registry(path=INVENTORY_PATH, cache_dir=CACHE_DIR):
+    '''
+    the FeatureRegistry of the inventory in path. It is loaded from a pickle in cache_dir if one was stored there for
+    the same content, and otherwise built and stored there (no cache with cache_dir=None).
+    '''
+    with open(path, 'rb') as f:
+        content = f.read()
+    key = inventory_key(content)
+    cache_path = os.path.join(cache_dir, f'{os.path.basename(path)}.registry.pickle') if cache_dir else None
+
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            try:
+                cached_key, state = pickle.load(f)
+            except Exception: # cut short
+                cached_key = None
+        if cached_key == key:
+            registry = FeatureRegistry.__new__(FeatureRegistry)
+            registry.__dict__.update(state)
+            return registry
+
+    registry = FeatureRegistry(content.decode('utf8').split('\n'))
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # only the indexes are stored, so the pickle does not depend on the module the class was loaded as
+        utils.atomic_write(cache_path, lambda f: pickle.dump((key, registry.__dict__), f, pickle.HIGHEST_PROTOCOL),
+                           binary=True)
+    return registry
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('values', nargs='*', help='values to look up')
+    parser.add_argument('--inventory', default=INVENTORY_PATH, help='the inventory (default: inventory.md of the repository)')
+    args = parser.parse_args()
+
+    registry = load_registry(args.inventory)
+    print(f'{len(registry)} values in {len(registry.categories)} categories, {len(registry.languages)} languages')
+    for value in args.values:
+        if value not in registry:
+            print(f'{value}: not in the inventory')
+            continue
+        for category, description in zip(registry.values[value], registry.descriptions[value]):
+            print(f'{value}: {description["name"]} ({category}) - {description["description"]}')
+        for language in registry.languages:
+            if value in registry.exponents[language]:
+                print(f'\t{language}: {", ".join(registry.exponents[language][value])}')
@@ -1,3 +1,5 @@
+import os
+import sys
 import json
 
 import conllu
@@ -5,7 +7,7 @@ import conllu
 
 def init_case_map(rel: dict):
     case_feat_map = {}
-    for k,v in rel_dict.items():
+    for k,v in rel.items():
         if v == "NONE":
             continue
         else:
@@ -19,6 +21,15 @@ if __name__ == '__main__':
     with open("./rel.json",'r',encoding="utf-8") as rel:
         rel_dict = json.load(rel)
 
+    # registry.py is in the directory above, which is not on the path when the script is run from here
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from registry import load_registry
+
+    registry = load_registry()
+    for value in rel_dict:
+        if value not in registry:
+            print(f'"{value}" in rel.json is not a value of inventory.md')
+
     case_feat_map = init_case_map(rel_dict)
 
     with open("./case_feat_map.json","w",encoding="utf-8") as outfile:
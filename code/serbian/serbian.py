@@ -4,9 +4,12 @@ from copy import deepcopy
 from collections import defaultdict
 import sys
 import json
+import inspect
 
 import conllu
 import utils as utils
+import annotator
+import incremental
 
 
 with open("./case_feat_map.json",'r',encoding="utf-8") as f:
@@ -62,30 +65,73 @@ def create_abstract_nsubj(head: conllu.Token, auxes: List[conllu.Token]):
     return abstract_nsubj
 
 
-def get_rel_feat(word): # try to get the relation feature from the marker feature map, if not - from the case feature map, if not - return the word itself
+def get_rel_feat(word, fixed_lemma=None): # try to get the relation feature of the fixed expression from the case feature map, if not - of the word, if not - return the word itself
+    if fixed_lemma in case_feat_map:
+        return case_feat_map[fixed_lemma]
     return case_feat_map.get(word, word)
 
 
-def get_relation_feats(relation_nodes: List[conllu.Token], verb=True, clause=False) -> dict:
+def get_relation_feats(relation_nodes: List[conllu.Token], verb=True, clause=False, fixed_lemmas=None) -> dict:
     '''
     Generating morpho_syntactic features for relations.
     The mapping from words (or fixed expressions) to features is in 'eng_relations.py' and should be updated there.
+    Fixed expressions are looked up by their multiword lemma in fixed_lemmas (see utils.fixed_expressions()).
     '''
     feats = {}
+    fixed_lemmas = fixed_lemmas or {}
 
-    relation_nodes = deepcopy(relation_nodes)
-    for node in relation_nodes: # if the node is a fixed node, take its fixed lemma, otherwise take its lemma
-        node['lemma'] = node.get('fixed lemma', node.get('lemma'))
+    feats['Case'] = ';'.join([get_rel_feat(node['lemma'], fixed_lemmas.get(node['id'])) # the multiword lemma of the heads of fixed expressions
+                             for node in relation_nodes])
+
+    return feats
+
+
+def nTAM_signature(aux_nodes: List[conllu.Token], head_feats: dict, verb=True, children: List[conllu.Token] = ()):
+    '''
+    everything get_nTAM_feats reads, so calls with equal signatures give equal features.
+    '''
+    subj_ids = [child['id'] for child in children if child['deprel'] in {'nsubj', 'expl'}]
+    inversion = bool(subj_ids) and min(aux['id'] for aux in aux_nodes) < min(subj_ids)
+    question = inversion and any(child['form'] == '?' for child in children)
+    auxes = tuple((aux['lemma'], aux['form'], aux['deprel'], utils.feats_key(aux['feats'])) for aux in aux_nodes)
+    return verb, utils.feats_key(head_feats), auxes, inversion, question
 
-    feats['Case'] = ';'.join([get_rel_feat(node['lemma']) for node in relation_nodes])
 
+nTAM_cache = utils.LRUCache(maxsize=1 << 14)
+reported = None # the messages report() recorded while a result of get_nTAM_feats is computed for nTAM_cache
+
+
+def report(message):
+    if reported is None:
+        print(message)
+    else:
+        reported.append(message)
+
+
+def memoized_nTAM_feats(aux_nodes: List[conllu.Token], head_feats: dict, verb=True, children: List[conllu.Token] = ()) -> dict:
+    '''
+    get_nTAM_feats, memoized in nTAM_cache by nTAM_signature(). The messages it reports are stored with the features and
+    printed every time they are used, as if the features were computed again.
+    '''
+    def compute():
+        global reported
+        reported = []
+        try:
+            return get_nTAM_feats(aux_nodes, head_feats, verb=verb, children=children), reported
+        finally:
+            reported = None
+
+    feats, messages = annotator.memoize_unless_asked(nTAM_cache, nTAM_signature(aux_nodes, head_feats, verb, children), compute)
+    for message in messages:
+        print(message)
     return feats
 
 
-def get_nTAM_feats(aux_nodes: List[conllu.Token], head_feats: dict, verb=True) -> dict:
+def get_nTAM_feats(aux_nodes: List[conllu.Token], head_feats: dict, verb=True, children: List[conllu.Token] = ()) -> dict:
     '''
     generating morpho-syntactic features for a head node based on its own morphological features (head_feats) and its auxiliaries (all concatenated as list in aux_nodes).
     This methods works for both verbal and nominal predicates.
+    children are all the children of the head, punctuation included, to detect questions.
     '''
     feats = defaultdict(str)
 
@@ -130,7 +176,7 @@ def get_nTAM_feats(aux_nodes: List[conllu.Token], head_feats: dict, verb=True) -
                     feats['Tense'] = biti_node['feats'].get('Tense', 'Pres')
                     feats['Mood'] = biti_node['feats'].get('Mood', 'Ind')
                     feats['Aspect'] = feats.get('Aspect', 'Imp')
-                    print(f"Unhandled single 'biti' case fallback applied. Node: {biti_node}")
+                    report(f"Unhandled single 'biti' case fallback applied. Node: {biti_node}")
             higher_biti = biti_node  # Single 'biti' node is the higher auxiliary
 
         elif len(biti_nodes) >= 2:  # Two or more 'biti' nodes
@@ -219,28 +265,16 @@ def set_nodes(nodes):
     return {node['id'] for node in nodes}
 
 
-def combine_fixed_nodes(head, fixed_children):
-    '''
-    In cases where several function words are combined to one meaning (e.g., because of, more then) they are tagged with
-     a 'fixed' deprel and are combined to one temporary lemma to look for in the relevant map in 'eng_relations.py'.
-    '''
-    if not fixed_children:
-        return head['lemma']
-
-    l = [head] + fixed_children
-    l.sort(key=lambda node: node['id'])
-    return ' '.join([node['lemma'] for node in l])
-
-
-def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
+def apply_grammar(head: conllu.Token, children: List[conllu.Token], fixed_lemmas: dict = None):
     '''
     The main method combining functional children to create the morpho-syntactic features of head.
+    In cases where several function words are combined to one meaning (e.g., because of, more than) they are tagged with
+    a 'fixed' deprel, and the relation they mark is looked up by their multiword lemma in fixed_lemmas.
     '''
+    all_children = children
 
     children = [child for child in children if not child['deprel'] in {'parataxis', 'reparandum', 'punct'}] # remove punctuation and parataxis and reparandum
 
-    fixed_children = [child for child in children if child['deprel'] == 'fixed']
-    head['fixed lemma'] = combine_fixed_nodes(head, fixed_children) # combine the fixed nodes to one lemma for further processing
     children = [child for child in children if child['deprel'] != 'fixed'] # remove the fixed nodes from the children
 
     added_nodes = []
@@ -257,7 +291,8 @@ def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
     # if there are auxiliaries "consume" them to change head's feats
     TAM_nodes = [child for child in children if (child['upos'] in {'AUX', 'PART'} and child['deprel'] != "advmod")] 
     if TAM_nodes and head['upos'] not in ("SCONJ","PART"):
-        head['ms feats'].update(get_nTAM_feats(TAM_nodes, head['feats'], verb=verb)) # update the head's features with the features of the auxiliaries
+        nTAM_feats = memoized_nTAM_feats(TAM_nodes, head['feats'], verb, all_children)
+        head['ms feats'].update(nTAM_feats) # update the head's features with the features of the auxiliaries
 
         if not head['ms feats'].get('Mood', None): head['ms feats']['Mood'] = 'Ind' #set Mood to Ind by default
         if not head['ms feats'].get('Polarity', None): head['ms feats']['Polarity'] = 'Pos' #set Polarity to Pos by default
@@ -270,7 +305,8 @@ def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
                       and (child['upos'] not in ['PART','CCONJ'])]
 
     if relation_nodes:
-        to_update = get_relation_feats(relation_nodes, verb=verb, clause=head['deprel'] in clausal_rels)
+        to_update = get_relation_feats(relation_nodes, verb=verb, clause=head['deprel'] in clausal_rels,
+                                       fixed_lemmas=fixed_lemmas)
         if to_update and not head['ms feats']:
             head['ms feats'] = to_update
         else:
@@ -278,7 +314,8 @@ def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
 
     # make sure we did not use the same node twice
     assert not set_nodes(TAM_nodes) & set_nodes(relation_nodes)
-    children = [node for node in children if node not in relation_nodes + TAM_nodes] # remove the auxiliaries and the relations from the children
+    consumed = set_nodes(TAM_nodes) | set_nodes(relation_nodes)
+    children = [node for node in children if node['id'] not in consumed] # remove the auxiliaries and the relations from the children
 
     if verb:
         # copy values from the morphological feats if they were not set by now
@@ -309,7 +346,7 @@ def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
 
             #assert len(det_nodes) == 1 # in eng script this was here, seems like in Serbian it doesn't need to be the case ("Neki Njegovi")
             for det_node in det_nodes:
-                children = [node for node in children if node != det_node]
+                children = [node for node in children if node['id'] != det_node['id']]
                 for k,v in list(determiners[det_node['lemma']].items()):
                     head['ms feats'][k] = v
 
@@ -330,19 +367,17 @@ def apply_grammar(head: conllu.Token, children: List[conllu.Token]):
             child['ms feats'] = ms_feats
         
 
-    del head['fixed lemma']
-
     return added_nodes
 
 
-def get_where_to_add(added_nodes, id2idx): # get where to add the abstract nsubj, right now before the verb
+def get_where_to_add(added_nodes, head_index): # get where to add the abstract nsubj, right now before the verb
     res = []
     for node in added_nodes:
         idx = int(node['id'])
         if idx == 0:
             res.append(-1)
         else:
-            res.append(id2idx[idx])
+            res.append(head_index.position(idx))
     return res
 
 def order_alphabetically(feats: str):
@@ -350,55 +385,134 @@ def order_alphabetically(feats: str):
     feats = sorted(feats)
     return '|'.join(feats)
 
+def convert_sentence(parse_list: conllu.TokenList) -> str:
+    '''
+    applies the grammar to all heads of one sentence and returns it serialized with its ms-feats.
+    '''
+    head_index = utils.HeadIndex(parse_list)
+    heads = list(head_index.post_order())
+    assert utils.verify_span(heads[::-1])
+    fixed_lemmas = utils.fixed_expressions(parse_list)
+    to_add = []
+    for head, children in heads:
+        children = [parse_list[i] for i in head_index.children(head)]
+        head: conllu.Token = parse_list[head_index.position(head)]
+        added_nodes = apply_grammar(head, children, fixed_lemmas)
+        if added_nodes:
+            added_idxs = get_where_to_add(added_nodes, head_index)
+            to_add += list(zip(added_nodes, added_idxs))
+
+    # from the last position to the first, so that no insertion shifts the positions of those still to come
+    for node, idx in sorted(to_add, key=lambda added: (added[1], added[0]['id']), reverse=True):
+        parse_list.insert(idx + 1, node)
+
+    for node in parse_list:
+        # setting ms-feats for content nodes that were not dealt with earlier
+        if ((node['upos'] in {'ADJ', 'INTJ'} | VERBAL | NOMINAL) or (node['upos']=="CCONJ" and node['deprel']=="discourse")) and not node.get('ms feats', None): # if the node is a content node and the ms_feats are not set
+            ms_feats = deepcopy(node['feats'])
+            if ms_feats is None:
+                ms_feats = '|'
+            node['ms feats'] = ms_feats
+        # function nodes end up with empty ms-feats
+        else:
+            node['ms feats'] = node.get('ms feats', None)
+
+        # sort alphabetically the MS features of all nodes
+        if node['ms feats'] and len(node["ms feats"])>1:
+            node['ms feats'] = order_alphabetically(node['ms feats'])
+
+    return parse_list.serialize()
+
+
+def convert_text(text: str) -> str:
+    '''
+    converts the raw text of one sentence; the unit of work of the parallel mode.
+    '''
+    return convert_sentence(utils.parse_sentence(text)) + '\n'
+
+
+def convert_text_indexed(text: str):
+    '''
+    convert_text(), along with the sent_id of the sentence and its words (see incremental.sentence_words()), so
+    --incremental can index the sentences in the parallel mode.
+    '''
+    parse_list = utils.parse_sentence(text)
+    sent_id, words = parse_list.metadata.get('sent_id'), incremental.sentence_words(parse_list)
+    return convert_sentence(parse_list) + '\n', sent_id, words
+
+
+def rule_tables():
+    '''
+    the tables whose entries are looked up by the lemma, upos or deprel of a node, with the column they are looked up
+    by. A change to an entry only affects the sentences holding its key (see incremental.affected_sentences()).
+    '''
+    return {'case_feat_map': ('lemma', case_feat_map), 'modalities': ('lemma', modalities),
+            'determiners': ('lemma', determiners), 'VERBAL': ('upos', VERBAL), 'NOMINAL': ('upos', NOMINAL),
+            'clausal_rels': ('deprel', clausal_rels)}
+
+
+def code_fingerprint():
+    '''
+    a hash of everything else the conversion depends on: utils, annotator and the functions of this module, but not its
+    rule tables (see rule_tables()). Any change to them means converting everything again.
+    '''
+    module = sys.modules[__name__]
+    functions = [obj for obj in vars(module).values() if inspect.isfunction(obj) and obj.__module__ == __name__]
+    return incremental.code_fingerprint(utils, annotator, *functions)
+
+
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('split', choices=['train', 'dev', 'test'])
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--parse-cache', metavar='DIR',
+                        help='keep the parsed input in DIR and load it from there as long as the input is unchanged')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only reconvert the sentences affected by the rule tables changed since the last run, in the '
+                             'existing output. everything is converted if the input or the code changed')
+    args = parser.parse_args()
+    split = args.split
 
-    split = sys.argv[1]
-    
     # filepath = os.path.join(ud_dir, lang, bank, splits[bank]['test'])
     # out_path = os.path.join('UD+', lang, bank, 'test.conllu')
-    with open(f"../../../UD_Serbian-SET/sr_set-ud-{split}.conllu", encoding='utf8') as f:
-        parse_trees = list(conllu.parse_tree_incr(f))
-    with open(f"../../../UD_Serbian-SET/sr_set-ud-{split}.conllu", encoding='utf8') as f:
-        parse_lists = list(conllu.parse_incr(f))
-
-    assert len(parse_lists) == len(parse_trees)
-    with open(f"../../data/serbian/{split}.out.conllu", 'w', encoding='utf8') as outfile:
-        for i in range(len(parse_trees)): # iterate over the sentences
-            parse_tree = parse_trees[i]
-            parse_list: conllu.TokenList = parse_lists[i]
-
-            id2idx = {token['id']:i for i, token in enumerate(parse_list) if isinstance(token['id'], int)}
-            idx2id = [token['id'] if isinstance(token['id'], int) else None for token in parse_list]
-
-            heads = utils.span(parse_tree)
-            assert utils.verify_span(heads)
-            to_add = []
-            for head, children in heads[::-1]:
-                head: conllu.Token = parse_list[id2idx[head]]
-                children = [parse_list[id2idx[child]] for child in children]
-                added_nodes = apply_grammar(head, children)
-                if added_nodes:
-                    added_idxs = get_where_to_add(added_nodes, id2idx)
-                    to_add += list(zip(added_nodes, added_idxs))
-
-            for added_node in to_add[::-1]:
-                node, idx = added_node
-                parse_list.insert(idx + 1, node)
-
-            for node in parse_list:
-                # setting ms-feats for content nodes that were not dealt with earlier
-                if ((node['upos'] in {'ADJ', 'INTJ'} | VERBAL | NOMINAL) or (node['upos']=="CCONJ" and node['deprel']=="discourse")) and not node.get('ms feats', None): # if the node is a content node and the ms_feats are not set
-                    ms_feats = deepcopy(node['feats'])
-                    if ms_feats is None:
-                        ms_feats = '|'
-                    node['ms feats'] = ms_feats
-                # function nodes end up with empty ms-feats
-                else:
-                    node['ms feats'] = node.get('ms feats', None)
-
-                # sort alphabetically the MS features of all nodes
-                if node['ms feats'] and len(node["ms feats"])>1:
-                    node['ms feats'] = order_alphabetically(node['ms feats'])
+    in_path = f"../../../UD_Serbian-SET/sr_set-ud-{split}.conllu"
+    out_path = f"../../data/serbian/{split}.out.conllu"
+    dependencies_path = out_path + '.deps.json'
+    affected = None
+    if args.incremental:
+        input_key, code, tables = utils.parse_cache_key(in_path), code_fingerprint(), rule_tables()
+        dependencies = incremental.load_dependencies(dependencies_path) if os.path.exists(out_path) else None
+        affected = incremental.affected_sentences(dependencies, input_key, code, tables)
+
+    if affected is not None:
+        with open(in_path, encoding='utf8') as f:
+            replacements = {utils.sentence_id(text): convert_text(text) for text in conllu.parse_sentences(f)
+                            if utils.sentence_id(text) in affected}
+        incremental.splice_sentences(out_path, replacements)
+        incremental.save_dependencies(dependencies_path, input_key, code, tables, dependencies['index'])
+        print(f'reconverted {len(replacements)} sentences')
 
-            to_write = parse_list.serialize()
-            outfile.write(to_write + '\n')
\ No newline at end of file
+    else:
+        # the sentences are indexed as they are converted, so the input is read once
+        indexer = incremental.SentenceIndexer() if args.incremental else None
+        with open(in_path, encoding='utf8') as f, open(out_path, 'w', encoding='utf8') as outfile:
+            if args.jobs > 1 and indexer is not None:
+                for converted, sent_id, words in utils.map_in_parallel(convert_text_indexed, conllu.parse_sentences(f),
+                                                                       args.jobs):
+                    outfile.write(converted)
+                    indexer.add(sent_id, words)
+            elif args.jobs > 1:
+                utils.convert_in_parallel(f, outfile, convert_text, args.jobs)
+            else:
+                if args.parse_cache:
+                    sentences = list(utils.parse_cached(in_path, args.parse_cache))
+                else:
+                    sentences = list(utils.parse_incr(f))
+                if indexer is not None:
+                    sentences = indexer.indexed(sentences)
+                for parse_list in sentences: # iterate over the sentences
+                    outfile.write(convert_sentence(parse_list) + '\n')
+        if indexer is not None:
+            incremental.save_dependencies(dependencies_path, input_key, code, tables, indexer.index)
@@ -0,0 +1,9 @@
+'''
+The Swedish language pack of the conversion engine (see engine.py).
+Swedish has no rules of its own yet, so it uses the English tables and auxiliary handler. Override them here as the
+Swedish rules are written.
+'''
+from english.english import *
+
+bank = None
+excluded_genres = []
@@ -0,0 +1,9 @@
+'''
+The Ukrainian language pack of the conversion engine (see engine.py).
+Ukrainian has no rules of its own yet, so it uses the English tables and auxiliary handler. Override them here as the
+Ukrainian rules are written.
+'''
+from english.english import *
+
+bank = None
+excluded_genres = []
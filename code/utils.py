@@ -1,5 +1,228 @@
 from typing import List, Union
-from copy import deepcopy
+from itertools import islice
+from array import array
+from functools import lru_cache, wraps
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+import multiprocessing
+import importlib.metadata
+import hashlib
+import inspect
+import pickle
+import zlib
+import io
+import os
+import re
+import time
+
+import conllu
+from conllu.parser import parse_dict_value
+
+
+class FrozenFeats(dict):
+    '''
+    The parsed FEATS of a token. The same feature string always gives the very same FrozenFeats, shared by all the
+    tokens that have it, so it can not be changed in place. Copying it (dict(), copy() or deepcopy()) gives a plain
+    dict to change instead, so only the features a rule actually writes to are ever copied.
+    '''
+    __slots__ = ('source',) # the FEATS string it was parsed from
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError('parsed feats are shared between tokens, change a copy of them instead (e.g. dict(feats))')
+
+    __setitem__ = __delitem__ = __ior__ = _frozen
+    update = pop = popitem = clear = setdefault = _frozen
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict(self) # the values are strings, so a shallow copy is a deep one
+
+    def __reduce__(self):
+        # pickled as the string it was parsed from, so loading it interns it again
+        return parse_feats, (self.source,)
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_feats(value):
+    '''
+    parses a FEATS string exactly as conllu does, once per distinct string.
+    :return: a shared FrozenFeats, or None for '_'
+    '''
+    feats = parse_dict_value(value)
+    if feats is None:
+        return None
+    feats = FrozenFeats(feats)
+    feats.source = value
+    return feats
+
+
+def feats_key(feats):
+    '''
+    a hashable stand-in for parsed feats, for keys of caches.
+    '''
+    if feats is None:
+        return None
+    if isinstance(feats, FrozenFeats):
+        return feats.source
+    return tuple(feats.items())
+
+
+# conllu field parsers giving shared FrozenFeats for the FEATS column
+FIELD_PARSERS = {'feats': lambda line, i: parse_feats(line[i])}
+
+
+def parse_incr(in_file):
+    '''
+    the same as conllu.parse_incr(), but with shared, memoized FEATS (see FrozenFeats).
+    '''
+    return conllu.parse_incr(in_file, field_parsers=FIELD_PARSERS)
+
+
+def parse_sentence(text):
+    '''
+    parses the text of a single sentence, as yielded by conllu.parse_sentences(), into a token list.
+    '''
+    return conllu.parse_token_and_metadata(text, field_parsers=FIELD_PARSERS)
+
+
+PARSE_CACHE_FORMAT = 3 # bump when the way sentences are stored in the cache changes
+PARSE_CACHE_BLOCK = 256 # how many sentences are pickled and compressed together in the cache
+
+
+def parse_cache_key(path):
+    '''
+    a hash of the content of the conllu file in path, of the version of the conllu parser and of the cache format, so
+    a cached parse is never used once any of them changed.
+    '''
+    digest = hashlib.sha256(f'conllu {importlib.metadata.version("conllu")} format {PARSE_CACHE_FORMAT}\n'.encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_file(path, binary=False):
+    '''
+    a file open for writing that takes the place of path only once the with block is left without an error, so an
+    interrupted write never leaves a truncated file behind. Otherwise the partial file is removed.
+    '''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf8') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_write(path, writer, binary=False):
+    '''
+    writes path with writer, a function of the open file, in place of its previous content (see atomic_file()).
+    '''
+    with atomic_file(path, binary) as f:
+        writer(f)
+
+
+def encode_sentence(parse_list, fields_seen):
+    '''
+    a token list as plain values: its metadata, its field names, stored once, and the values of every token.
+    :param fields_seen: the field names of the sentences encoded before, so equal ones are stored only once
+    '''
+    fields = tuple(parse_list.default_fields)
+    fields = fields_seen.setdefault(fields, fields)
+    return dict(parse_list.metadata), fields, [tuple(token.values()) for token in parse_list]
+
+
+def decode_sentence(metadata, fields, values):
+    '''
+    the token list encoded by encode_sentence().
+    '''
+    tokens = [conllu.models.Token(zip(fields, token)) for token in values]
+    return conllu.TokenList(tokens, conllu.models.Metadata(metadata), default_fields=list(fields))
+
+
+def parse_cached(path, cache_dir):
+    '''
+    yields the sentences of the conllu file in path as token lists, like conllu.parse_incr(), but loads them from a
+    compact binary copy in cache_dir when the file was parsed before, which is several times faster than parsing.
+    The copy holds blocks of PARSE_CACHE_BLOCK sentences, encoded by encode_sentence(), pickled together and
+    compressed, which takes about a quarter of the size of the file.
+    The cache is written while parsing, one block at a time, and only kept once all sentences were read. Older cached
+    copies of the same file are removed, files of the same name in other directories have copies of their own.
+    '''
+    name = f'{os.path.basename(path)}.{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]}'
+    cache_path = os.path.join(cache_dir, f'{name}.{parse_cache_key(path)[:16]}.pickle')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            while True:
+                try:
+                    block = pickle.Unpickler(io.BytesIO(zlib.decompress(pickle.load(f))))
+                except EOFError:
+                    return
+                while True:
+                    try:
+                        sentence = block.load()
+                    except EOFError:
+                        break
+                    yield decode_sentence(*sentence)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, encoding='utf8') as in_file, atomic_file(cache_path, binary=True) as f:
+        block, sentences, fields_seen = None, 0, {}
+        for parse_list in parse_incr(in_file):
+            if block is None:
+                # one pickler per block, so values repeated in the block are stored once
+                block = io.BytesIO()
+                pickler = pickle.Pickler(block, pickle.HIGHEST_PROTOCOL)
+            # stored before it is yielded, as the caller may change it
+            pickler.dump(encode_sentence(parse_list, fields_seen))
+            sentences += 1
+            if sentences % PARSE_CACHE_BLOCK == 0:
+                pickle.dump(zlib.compress(block.getvalue(), 1), f, pickle.HIGHEST_PROTOCOL)
+                block = None
+            yield parse_list
+        if block is not None:
+            pickle.dump(zlib.compress(block.getvalue(), 1), f, pickle.HIGHEST_PROTOCOL)
+        for old in os.listdir(cache_dir):
+            if old.startswith(name + '.') and old.endswith('.pickle'):
+                os.remove(os.path.join(cache_dir, old))
+
+
+def map_in_parallel(function, items, jobs, chunksize=64, initializer=None, initargs=()):
+    '''
+    yields function(item) for every item of items, computed by a pool of jobs worker processes, in the original order.
+    function must be a module-level function. initializer(*initargs) is called once in every worker.
+    items are taken window by window, so memory does not grow with their number.
+    '''
+    window = jobs * chunksize * 4
+    items = iter(items)
+    with multiprocessing.Pool(jobs, initializer, initargs) as pool:
+        while True:
+            chunk = list(islice(items, window))
+            if not chunk:
+                break
+            yield from pool.imap(function, chunk, chunksize)
+
+
+def convert_in_parallel(in_file, out_file, convert, jobs, chunksize=64, initializer=None, initargs=()):
+    '''
+    converts the sentences of in_file with a pool of jobs worker processes and writes the results to out_file in the
+    original order.
+    convert is called with the raw text of one sentence and returns the text to write for it. It must be a module-level
+    function, so the workers import its module (and load its rule tables) only once and not once per sentence.
+    initializer(*initargs) is called once in every worker, e.g. to load the annotator's decisions.
+    The input is read window by window, so memory does not grow with the size of the treebank.
+    '''
+    sentences = conllu.parse_sentences(in_file)
+    for converted in map_in_parallel(convert, sentences, jobs, chunksize, initializer, initargs):
+        out_file.write(converted)
 
 
 def span(parse_tree):
@@ -10,15 +233,128 @@ def span(parse_tree):
     '''
     res = []
     waiting_list = [parse_tree]
-    while waiting_list:
-        curr = waiting_list[0]
+    for curr in waiting_list: # the list grows while iterating, which makes it a breadth-first walk
         if curr.children:
             res.append([curr.token['id'], [child.token['id'] for child in curr.children]])
             waiting_list += curr.children
-        waiting_list = waiting_list[1:]
     return res
 
 
+def fixed_expressions(parse_list):
+    '''
+    the fixed expressions of a sentence (e.g., because of), found once for the whole sentence so that no lemma or form
+    has to be rewritten: a dict from the id of the head of every expression to its multiword lemma, the lemmas of the
+    head and of its fixed children in the order of the sentence.
+    '''
+    parts = {}
+    for token in parse_list:
+        if token['deprel'] == 'fixed' and isinstance(token['id'], int):
+            parts.setdefault(token['head'], []).append((token['id'], token['lemma']))
+    if not parts:
+        return parts
+    for token in parse_list:
+        if isinstance(token['id'], int) and token['id'] in parts:
+            parts[token['id']].append((token['id'], token['lemma']))
+    return {head: ' '.join(lemma for _, lemma in sorted(lemmas)) for head, lemmas in parts.items()}
+
+
+def post_order(root, children_of):
+    '''
+    walks the tree under root depth first, like a recursive walk would, but with a stack of its own, so deep trees
+    (e.g. long chains of coordination) cost no frame per level and never reach the recursion limit.
+    :param children_of: a function from a node to the list of its children
+    :return: yields (node, children) for every node that has children, after all the nodes under it
+    '''
+    stack = [[root, children_of(root), 0]] # a node, its children and the next of them to walk
+    while stack:
+        frame = stack[-1]
+        node, children, i = frame
+        if i < len(children):
+            frame[2] = i + 1
+            child = children[i]
+            stack.append([child, children_of(child), 0])
+        else:
+            stack.pop()
+            if children:
+                yield node, children
+
+
+class HeadIndex:
+    '''
+    An index of the heads of a sentence over the positions of its token list, built in linear time from the HEAD
+    column: where every id is and which positions are the children of every head. The tokens themselves are not copied,
+    the rules read and write them in the token list. Multiword tokens and empty nodes have id -1, tokens without a head
+    have head -1. The children of every node are stored next to each other, so finding them is a slice and no dict per
+    head is built. The index describes the token list as it was when it was built, nodes inserted later are not in it.
+    '''
+    __slots__ = ('sent_id', 'ids', 'heads', 'positions', 'child_starts', 'child_positions')
+
+    def __init__(self, parse_list):
+        self.sent_id = parse_list.metadata.get('sent_id')
+        size = len(parse_list)
+        self.ids = array('i', [-1]) * size
+        self.heads = array('i', [-1]) * size
+
+        max_id = 0
+        for i, token in enumerate(parse_list):
+            # like conllu's tree building, skip multiword tokens, empty nodes and tokens without a head
+            if isinstance(token['id'], int):
+                self.ids[i] = token['id']
+                max_id = max(max_id, token['id'])
+                if token['head'] is not None and token['head'] >= 0:
+                    self.heads[i] = token['head']
+
+        # the position of every id in the token list, -1 for ids not in the sentence
+        self.positions = array('i', [-1]) * (max_id + 1)
+        for i, token_id in enumerate(self.ids):
+            if token_id >= 0:
+                self.positions[token_id] = i
+
+        # counting sort of the positions by head, which keeps the children of every head in the order of the sentence.
+        # nodes attached to an id that is not in the sentence are left out, as they are not in conllu's trees either
+        self.child_starts = array('i', [0]) * (max_id + 2)
+        for head in self.heads:
+            if 0 <= head <= max_id:
+                self.child_starts[head + 1] += 1
+        for head_id in range(max_id + 1):
+            self.child_starts[head_id + 1] += self.child_starts[head_id]
+        self.child_positions = array('i', [0]) * self.child_starts[max_id + 1]
+        next_free = self.child_starts[:-1]
+        for i, head in enumerate(self.heads):
+            if 0 <= head <= max_id:
+                self.child_positions[next_free[head]] = i
+                next_free[head] += 1
+
+    def position(self, node_id):
+        '''
+        the position of node_id in the token list, a KeyError if it is not a node of the sentence (e.g., the dummy 0).
+        '''
+        i = self.positions[node_id] if 0 <= node_id < len(self.positions) else -1
+        if i < 0:
+            raise KeyError(node_id)
+        return i
+
+    def children(self, node_id):
+        '''
+        the positions of the children of node_id in the token list, in the order of the sentence.
+        '''
+        return self.child_positions[self.child_starts[node_id]:self.child_starts[node_id + 1]]
+
+    def child_ids(self, node_id):
+        return [self.ids[i] for i in self.children(node_id)]
+
+    def post_order(self):
+        '''
+        yields (head_id, [child_id, child_id, ...]) for every head, after all the heads under it (see post_order()),
+        so every head comes after its children are done. The tree is the same as span() walks: several roots hang from
+        a dummy node 0, exactly as in conllu's trees.
+        '''
+        roots = self.child_ids(0)
+        if not roots:
+            raise ValueError(f'no root in sentence {self.sent_id}')
+        return post_order(0 if len(roots) > 1 else roots[0], self.child_ids)
+
+
 def verify_span(heads: List[List[Union[List[int], int]]]):
     '''
     verifies that for a given list of heads and children, all heads appear in ascending id order
@@ -36,32 +372,182 @@ def verify_span(heads: List[List[Union[List[int], int]]]):
             return False
     return True
 
+def treeness_violation(ids, heads, ms_feats):
+    '''
+    checks that the content nodes (the nodes with ms-feats) make a tree, given the id, head and ms-feats columns of a
+    sentence as parallel lists.
+    :return: None if they do, otherwise a message saying which node breaks the tree
+    '''
+    content_heads = {node_id: head for node_id, head, feats in zip(ids, heads, ms_feats) if feats}
+    for node_id, head in content_heads.items():
+        if head != 0 and head not in content_heads:
+            return f'node {node_id} is attached to {head}, which is not a content node'
+
+    # walk up from every node, marking the nodes on the current path, until reaching the root or a checked node
+    checked = {0}
+    for node_id in content_heads:
+        path = set()
+        curr = node_id
+        while curr not in checked:
+            if curr in path:
+                return f'node {curr} is in a cycle'
+            path.add(curr)
+            curr = content_heads[curr]
+        checked |= path
+    return None
+
+
 def verify_treeness(parse_list):
     '''
     After assignment of ms_feats, making sure that the content nodes still make a tree.
+    :return: True, raises a ValueError naming the offending node otherwise
     '''
-    parse_list = deepcopy(parse_list)
-    new_list = []
-    new_ids = {0}
-    for node in parse_list:
-        node['feats'] = node['ms feats']
-        if node['feats']:
-            new_list.append(node)
-            new_ids.add(node['id'])
-    for node in new_list:
-        if node['head'] not in new_ids:
-            return False
+    violation = treeness_violation([node['id'] for node in parse_list],
+                                   [node['head'] for node in parse_list],
+                                   [node['ms feats'] for node in parse_list])
+    if violation:
+        raise ValueError(f'content nodes of sentence {parse_list.metadata.get("sent_id")} are not a tree: {violation}')
     return True
 
 
-def get_response(possible_responses, prompt):
+class LRUCache:
+    '''
+    A mapping holding at most maxsize entries, dropping the least recently used one first, that counts its hits and misses.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+
+class RuleStats:
+    '''
+    How often every rule fires and how much time it takes. A rule is either a function, wrapped by wrap(), or a branch
+    of one, marked by rule_hit(). The time of a call is split between the function and the branches marked in it:
+    every mark takes the time until the next mark or until the end of the call, nested calls excluded, so the seconds
+    of all the rules add up to the time spent in the wrapped functions.
+    '''
+    def __init__(self):
+        self.hits = Counter()
+        self.seconds = Counter()
+        self.current = None # the rule the time is going to now
+        self.since = 0.0
+        self.calls = [] # the rules the time went to before the calls in progress
+
+    def hit(self, rule):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.seconds[self.current] += now - self.since
+        self.hits[rule] += 1
+        self.current, self.since = rule, now
+
+    def leave(self):
+        now = time.perf_counter()
+        self.seconds[self.current] += now - self.since
+        self.current, self.since = self.calls.pop(), now
+
+    def wrap(self, function, rule):
+        '''
+        function, counting its calls and timing them as the rule rule.
+        '''
+        @wraps(function)
+        def counted(*args, **kwargs):
+            self.calls.append(self.current)
+            self.hit(rule)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return counted
+
+    def report(self, declared=()):
+        '''
+        :param declared: the names of all the rules, to list those that never fired
+        :return: the hits and seconds of every rule, the most expensive first, and the declared rules that never fired
+        '''
+        rules = {rule: {'hits': self.hits[rule], 'seconds': round(self.seconds[rule], 6)}
+                 for rule in sorted(self.hits, key=lambda rule: -self.seconds[rule])}
+        return {'rules': rules, 'never fired': sorted(set(declared) - set(self.hits))}
+
+
+rule_stats = None # the RuleStats in use, if any, see use_rule_stats()
+
+
+def use_rule_stats():
+    '''
+    starts counting the rules marked by rule_hit(); until then marking a rule costs a single check.
+    '''
+    global rule_stats
+    rule_stats = RuleStats()
+    return rule_stats
+
+
+def rule_hit(rule):
+    '''
+    marks that the rule rule fires, if rules are counted.
+    '''
+    if rule_stats is not None:
+        rule_stats.hit(rule)
+
+
+def declared_rules(*objects):
+    '''
+    the names of the rules marked with rule_hit() in the source of the given modules or functions.
+    '''
+    return {rule for obj in objects for rule in re.findall(r"rule_hit\('([^']+)'\)", inspect.getsource(obj))}
+
+
+def sentence_id(text):
+    '''
+    the sent_id of a sentence given as raw conllu text, or None if it has none.
+    '''
+    for line in text.split('\n'):
+        if line.startswith('#'):
+            key, _, value = line[1:].partition('=')
+            if key.strip() == 'sent_id':
+                return value.strip()
+        elif line.strip():
+            return None
+    return None
+
+
+def raw_sentences(in_file):
     '''
-    When one construction may serve several features, let the annotator decide which it is.
+    yields the text of every sentence in in_file exactly as it is written, with the empty lines following it.
     '''
-    response = None
-    while response not in possible_responses:
-        if response:
-            print(f'invalid response. options are {possible_responses}.')
-        print('##### USER INPUT NEEDED #####')
-        response = input(prompt)
-    return response
+    buf = []
+    ended = False
+    for line in in_file:
+        if line.strip():
+            if ended:
+                yield ''.join(buf)
+                buf = []
+                ended = False
+        elif buf:
+            ended = True
+        buf.append(line)
+    if buf:
+        yield ''.join(buf)
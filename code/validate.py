@@ -0,0 +1,184 @@
+'''
+Validates converted files (e.g. data/serbian/test.out.conllu) before they are used anywhere else. For every sentence it
+checks that
+
+- every node line has the ten CoNLL-U columns and the ms-feats column after them, with a valid id and head
+- the ms-feats are well formed: '_' for function nodes, '|' for content nodes without features, or Feat=Value pairs
+  sorted like the converters sort them, each feature at most once
+- the ids of abstract nodes are N.M, right after the node N (0 for the start of the sentence), and their heads exist
+- the content nodes (the nodes with ms-feats) make a tree, as utils.verify_treeness() checks during the conversion
+- every value of the relation features (Case) is in the FValue column of inventory.md
+
+The file is read one window of sentences at a time and the sentences of a window are checked by all the cores, so
+memory does not grow with the size of the file.
+
+usage:
+python code/validate.py data/serbian/test.out.conllu [more files] [--jobs N] [--inventory inventory.md]
+'''
+import os
+import re
+
+import utils
+from registry import load_registry, INVENTORY_PATH
+
+MS_FEATS = 10 # the column of the ms-feats, after the ten CoNLL-U columns
+INVENTORY_FEATS = {'Case'} # the features whose values are the relations of inventory.md
+
+feat_re = re.compile(r'^([A-Za-z][A-Za-z0-9-]*(?:\[[a-z0-9]+\])?)=([^\s=|]+)$')
+abstract_id_re = re.compile(r'^(\d+)\.([1-9]\d*)$')
+wrapped_re = re.compile(r'^\w+\((.*)\)$') # e.g. neg(Nec)
+
+inventory = None # the FeatureRegistry of inventory.md, in every process, see use_inventory()
+
+
+def use_inventory(path):
+    global inventory
+    inventory = load_registry(path) if path else None
+
+
+def ms_feats_errors(ms_feats):
+    '''
+    the problems with the ms-feats of one node, as messages.
+    '''
+    if ms_feats in {'_', '|'}:
+        return []
+    if not ms_feats:
+        return ['empty ms-feats, expected "_" or "|" at least']
+    errors = []
+    pairs = ms_feats.split('|')
+    names = []
+    for pair in pairs:
+        feat = feat_re.match(pair)
+        if not feat:
+            errors.append(f'malformed ms-feat "{pair}" in "{ms_feats}"')
+            continue
+        name, value = feat.groups()
+        names.append(name)
+        if name in INVENTORY_FEATS and inventory is not None:
+            for part in value.split(';'):
+                wrapped = wrapped_re.match(part)
+                relation = wrapped.group(1) if wrapped else part
+                if relation not in inventory:
+                    errors.append(f'{name}={relation} is not in the inventory')
+    if len(set(names)) < len(names):
+        errors.append(f'repeated feature in "{ms_feats}"')
+    if pairs != sorted(pairs):
+        errors.append(f'ms-feats "{ms_feats}" are not sorted')
+    return errors
+
+
+def sentence_errors(item):
+    '''
+    the problems of one sentence.
+    :param item: (the number of the first line of the sentence in its file, its text)
+    :return: a list of (line number, message)
+    '''
+    first_line, text = item
+    errors = []
+    ids, heads, ms_feats = [], [], []
+    last_id = 0 # the last regular id seen, abstract nodes follow it
+    last_abstract = 0
+    tree_checkable = True
+    for number, line in enumerate(text.split('\n'), first_line):
+        if not line or line.startswith('#'):
+            continue
+        columns = line.split('\t')
+        if len(columns) <= MS_FEATS:
+            errors.append((number, f'{len(columns)} columns, expected at least {MS_FEATS + 1}'))
+            tree_checkable = False
+            continue
+        node_id, head = columns[0], columns[6]
+        if '-' in node_id: # a multiword token, it has no head and no ms-feats of its own
+            continue
+
+        abstract = abstract_id_re.match(node_id)
+        if abstract:
+            base, index = int(abstract.group(1)), int(abstract.group(2))
+            if base != last_id or index <= last_abstract:
+                errors.append((number, f'abstract node {node_id} is not in its place, after node {last_id}'))
+            last_abstract = index
+            node_key = float(node_id)
+        elif node_id.isdigit():
+            if int(node_id) != last_id + 1:
+                errors.append((number, f'node {node_id} follows node {last_id}'))
+            last_id, last_abstract = int(node_id), 0
+            node_key = last_id
+        else:
+            errors.append((number, f'invalid id "{node_id}"'))
+            tree_checkable = False
+            continue
+
+        if not head.isdigit():
+            errors.append((number, f'node {node_id} has the head "{head}"'))
+            tree_checkable = False
+        else:
+            ids.append(node_key)
+            heads.append(int(head))
+            ms_feats.append(columns[MS_FEATS] != '_')
+        errors += [(number, message) for message in ms_feats_errors(columns[MS_FEATS])]
+
+    if tree_checkable:
+        known = set(ids) | {0}
+        for node_id, head in zip(ids, heads):
+            if head not in known:
+                errors.append((first_line, f'node {node_id} is attached to {head}, which is not in the sentence'))
+                tree_checkable = False
+    if tree_checkable:
+        violation = utils.treeness_violation(ids, heads, ms_feats)
+        if violation:
+            errors.append((first_line, f'content nodes are not a tree: {violation}'))
+    return errors
+
+
+def numbered_sentences(in_file):
+    '''
+    yields the text of every sentence in in_file with the number of its first line.
+    '''
+    number = 1
+    for text in utils.raw_sentences(in_file):
+        yield number, text
+        number += text.count('\n')
+
+
+def validate(path, jobs=1, inventory_path=None):
+    '''
+    yields the problems of the converted file in path as (line number, message), in the order of the file.
+    '''
+    with open(path, encoding='utf8') as f:
+        items = numbered_sentences(f)
+        if jobs > 1:
+            results = utils.map_in_parallel(sentence_errors, items, jobs, initializer=use_inventory,
+                                            initargs=(inventory_path,))
+        else:
+            use_inventory(inventory_path)
+            results = map(sentence_errors, items)
+        for errors in results:
+            for number, message in errors:
+                yield number, message
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='the converted files to validate')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes (default: all cores)')
+    parser.add_argument('--inventory', default=INVENTORY_PATH,
+                        help='the inventory of relations (default: inventory.md of the repository)')
+    parser.add_argument('--limit', type=int, default=100, help='most problems to print for every file')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        count = 0
+        for number, message in validate(path, args.jobs, args.inventory):
+            if count < args.limit:
+                print(f'{path}:{number}: {message}')
+            count += 1
+        if count:
+            failed = True
+            print(f'{path}: {count} problems')
+        else:
+            print(f'{path}: valid')
+    sys.exit(1 if failed else 0)
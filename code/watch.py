@@ -0,0 +1,254 @@
+'''
+A development mode for iterating on the rules: the treebank is parsed and converted once, kept in memory, and every
+time a rule file is saved only the sentences it may affect are converted again, printing how their ms-feats changed.
+
+The rule files watched are the modules of the language pack (e.g. english/english.py and english/eng_relations.py)
+and engine.py, or, for Serbian, serbian.py, rel.json, case_feat_map.json and determiners.json. rel.json is compiled into
+case_feat_map.json first, as compile_relations.py does. A change to a rule table only reconverts the sentences holding
+the entries that changed (see incremental.affected_sentences()); a change to the code reconverts everything.
+
+The annotator is never prompted: stored decisions are replayed and unanswered questions get a provisional answer, as
+with --defer in engine.py.
+
+usage (launch from a directory with the UD treebanks, see consts.py, or from code/serbian for Serbian):
+python code/watch.py --lang eng [--split test] [-i INPUT] [-o OUTPUT]
+python ../watch.py --lang srp [--split test]
+'''
+import os
+import sys
+import json
+import time
+import importlib
+import traceback
+
+import conllu
+import utils
+import annotator
+import incremental
+
+
+class PackTarget:
+    '''
+    the rules of a language pack of the conversion engine.
+    '''
+    def __init__(self, lang):
+        import engine
+        self.lang = lang
+        self.engine = engine
+        self.pack = engine.load_pack(lang)
+        # in the order they have to be reloaded in: every module after the ones it imports from
+        self.modules = [importlib.import_module(name) for name in
+                        dict.fromkeys(['english.eng_relations', 'english.english', engine.PACKS[lang], 'engine'])]
+
+    def files(self):
+        return [module.__file__ for module in self.modules]
+
+    def reload(self, changed):
+        for module in self.modules:
+            importlib.reload(module)
+
+    def tables(self):
+        return self.engine.rule_tables(self.pack)
+
+    def code(self):
+        return self.engine.code_fingerprint(self.pack)
+
+    def convert(self, parse_list):
+        if self.engine.in_excluded_genre(self.pack, parse_list):
+            return ''
+        return self.engine.convert_sentence(self.pack, parse_list) + '\n'
+
+
+class SerbianTarget:
+    '''
+    the rules of serbian.py, which reads its tables from json files in the working directory.
+    '''
+    def __init__(self):
+        self.serbian = importlib.import_module('serbian.serbian')
+        self.compile_relations = importlib.import_module('serbian.compile_relations')
+
+    def files(self):
+        return [self.serbian.__file__, 'rel.json', 'case_feat_map.json', 'determiners.json']
+
+    def reload(self, changed):
+        if 'rel.json' in changed:
+            with open('rel.json', encoding='utf-8') as f:
+                case_feat_map = self.compile_relations.init_case_map(json.load(f))
+            with open('case_feat_map.json', 'w', encoding='utf-8') as f:
+                json.dump(case_feat_map, f)
+        importlib.reload(self.serbian)
+
+    def tables(self):
+        return self.serbian.rule_tables()
+
+    def code(self):
+        return self.serbian.code_fingerprint()
+
+    def convert(self, parse_list):
+        return self.serbian.convert_sentence(parse_list) + '\n'
+
+
+def copy_sentence(parse_list):
+    '''
+    a copy of parse_list to convert, leaving the original as it was parsed. Only the tokens are copied: the conversion
+    sets their fields, but never changes their values in place (FEATS are read-only, see utils.FrozenFeats).
+    '''
+    return conllu.TokenList([conllu.Token(token) for token in parse_list], metadata=conllu.Metadata(parse_list.metadata),
+                            default_fields=parse_list.default_fields)
+
+
+def ms_feats_of(text):
+    '''
+    the form and ms-feats of every token of a converted sentence, by id.
+    '''
+    tokens = {}
+    for line in text.split('\n'):
+        if line and not line.startswith('#'):
+            columns = line.split('\t')
+            tokens[columns[0]] = (columns[1], columns[10] if len(columns) > 10 else '_')
+    return tokens
+
+
+def ms_feats_diff(old_text, new_text):
+    '''
+    the tokens whose ms-feats differ between two conversions of a sentence, as (id, form, old, new), where a token found
+    in only one of them (e.g. an abstract node) has None on the other side.
+    '''
+    old, new = ms_feats_of(old_text), ms_feats_of(new_text)
+    diff = []
+    for token_id in list(old) + [token_id for token_id in new if token_id not in old]:
+        form, old_feats = old.get(token_id, (None, None))
+        form, new_feats = new.get(token_id, (form, None))
+        if old_feats != new_feats:
+            diff.append((token_id, form, old_feats, new_feats))
+    return diff
+
+
+class Watcher:
+    '''
+    the parsed treebank, its conversion and what every sentence depends on, kept up to date with the rule files.
+    '''
+    def __init__(self, target, in_path, out_path=None, limit=50):
+        self.target = target
+        self.out_path = out_path
+        self.limit = limit
+        start = time.perf_counter()
+        with open(in_path, encoding='utf8') as f:
+            self.sentences = list(utils.parse_incr(f))
+        self.positions = {parse_list.metadata.get('sent_id'): i for i, parse_list in enumerate(self.sentences)}
+        self.index = incremental.sentence_index(self.sentences)
+        self.outputs = [''] * len(self.sentences)
+        self.convert(range(len(self.sentences)))
+        self.input_key = utils.parse_cache_key(in_path)
+        self.dependencies = incremental.dependencies_record(self.input_key, target.code(), target.tables(), self.index)
+        self.mtimes = self.stat()
+        self.write()
+        took = time.perf_counter() - start
+        print(f'converted {len(self.sentences)} sentences in {took:.1f} s, watching {len(self.mtimes)} files')
+
+    def stat(self):
+        return {path: os.stat(path).st_mtime_ns for path in self.target.files() if os.path.exists(path)}
+
+    def convert(self, positions):
+        '''
+        converts again the sentences in positions.
+        :return: a dict from their positions to their previous conversion, for those whose conversion changed
+        '''
+        changed = {}
+        for i in positions:
+            try:
+                output = self.target.convert(copy_sentence(self.sentences[i]))
+            except Exception as e:
+                print(f'{self.sentences[i].metadata.get("sent_id", i)}: {type(e).__name__}: {e}')
+                continue
+            if output != self.outputs[i]:
+                changed[i] = self.outputs[i]
+                self.outputs[i] = output
+        return changed
+
+    def write(self):
+        if self.out_path is None:
+            return
+        utils.atomic_write(self.out_path, lambda f: f.writelines(self.outputs))
+
+    def poll(self):
+        '''
+        reloads the rules and converts again the sentences they affect if a rule file changed since the last poll.
+        '''
+        mtimes = self.stat()
+        changed = [path for path in mtimes if mtimes[path] != self.mtimes.get(path)]
+        if not changed:
+            return
+        start = time.perf_counter()
+        try:
+            self.target.reload({os.path.basename(path) for path in changed})
+        except Exception:
+            traceback.print_exc()
+            print('the rules could not be reloaded, waiting for the next change')
+            self.mtimes = mtimes
+            return
+        self.mtimes = self.stat() # reloading may write rule files (e.g. case_feat_map.json)
+
+        # the same record engine.py --incremental stores, but kept in memory
+        code, tables = self.target.code(), self.target.tables()
+        affected = incremental.affected_sentences(self.dependencies, self.input_key, code, tables)
+        positions = range(len(self.sentences)) if affected is None else sorted(self.positions[sent_id] for sent_id in affected)
+        differences = self.convert(positions)
+        self.dependencies = incremental.dependencies_record(self.input_key, code, tables, self.index)
+        self.write()
+        took = (time.perf_counter() - start) * 1000
+
+        lines = []
+        for i, old_output in differences.items():
+            sent_id = self.sentences[i].metadata.get('sent_id', i)
+            for token_id, form, old, new in ms_feats_diff(old_output, self.outputs[i]):
+                lines.append(f'{sent_id}\t{token_id}\t{form}\t{old} -> {new}')
+        print(f'{", ".join(os.path.basename(path) for path in changed)} changed: reconverted {len(positions)} sentences '
+              f'in {took:.0f} ms, {len(differences)} changed ({len(lines)} tokens)')
+        for line in lines[:self.limit]:
+            print(line)
+        if len(lines) > self.limit:
+            print(f'... and {len(lines) - self.limit} more')
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.poll()
+
+
+if __name__ == '__main__':
+    import argparse
+    from engine import PACKS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lang', default='eng', choices=sorted(PACKS) + ['srp'], help='the rules to watch')
+    parser.add_argument('--bank', help='the treebank to convert (default: the default bank of the language)')
+    parser.add_argument('--split', default='test', choices=['train', 'dev', 'test'])
+    parser.add_argument('-i', '--input', help='the conllu file to convert (default: as in engine.py or serbian.py)')
+    parser.add_argument('-o', '--output', help='also keep the converted file here up to date (default: none)')
+    parser.add_argument('--decisions', help='json file of the annotator\'s decisions (default: as in engine.py)')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between checks of the rule files')
+    parser.add_argument('--limit', type=int, default=50, help='most changed tokens to print after every change')
+    args = parser.parse_args()
+
+    if args.lang == 'srp':
+        target = SerbianTarget()
+        filepath = args.input or f'../../../UD_Serbian-SET/sr_set-ud-{args.split}.conllu'
+    else:
+        target = PackTarget(args.lang)
+        bank = args.bank or target.pack.bank
+        if bank is None and not (args.input and (args.output or args.decisions)):
+            parser.error(f'no default treebank for {args.lang}, give --bank or --input with --output or --decisions')
+        if args.input:
+            filepath = args.input
+        else:
+            from consts import ud_dir, splits
+            filepath = os.path.join(ud_dir, args.lang, bank, splits[bank][args.split])
+        decisions_path = args.decisions or (args.output or os.path.join('UD+', args.lang, bank, f'{args.split}.conllu')) + '.decisions.json'
+        annotator.use_decisions(decisions_path, defer_to=os.devnull)
+
+    watcher = Watcher(target, filepath, args.output, args.limit)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        sys.exit(0)